@@ -75,7 +75,7 @@ class Asset:
         self.mass = float(data.find('Mass').text)
         self.drag = float(data.find('Drag').text)
         self.mesh_center = parse_vector(data, 'MeshCenter')
-        self.mesh_center = parse_vector(data, 'MeshExtent')
+        self.mesh_extent = parse_vector(data, 'MeshExtent')
         self.mesh_radius = float(data.find('MeshRadius').text)
 
     def parse_files(self, data):
@@ -315,6 +315,12 @@ class Model3D:
 
         return model
 
+    def get_vertex_format(self):
+        for material in self.materials:
+            if material.vertex_format:
+                return material.vertex_format
+        return None
+
 
 @dataclass
 class Decal:
@@ -0,0 +1,78 @@
+import os
+import pickle
+import sqlite3
+import threading
+import zlib
+
+# Increment when the Asset/PRP classes change, to ignore older cache entries
+CACHE_VERSION = 2
+# Folder of the viewer in the cache folder of the user
+USER_CACHE_FOLDER = 'anno1800_model_viewer'
+
+
+def get_user_cache_path(name):
+    """Path of a file in the cache folder of the user. Entries are unpickled, so they are never read from the data
+    folder, which may come from anyone"""
+    if os.name == 'nt':
+        root = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        root = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(root, USER_CACHE_FOLDER, name)
+
+
+class AssetDiskCache:
+    """Parsed cfg and prp files (Asset and PRP objects) stored in a SQLite database.
+    Entries are keyed by the file path, and are valid while the size and modification time of the file don't change."""
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        """Open the database, raises OSError or sqlite3.Error if it can't be created"""
+        if self.connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            try:
+                # Commits don't wait for the disk, a lost entry is parsed again
+                connection.execute('PRAGMA journal_mode=WAL')
+                connection.execute('PRAGMA synchronous=NORMAL')
+                connection.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, '
+                                   'mtime INTEGER, version INTEGER, data BLOB)')
+            except sqlite3.Error:
+                connection.close()
+                raise
+            self.connection = connection
+        return self.connection
+
+    @staticmethod
+    def get_key(file_path):
+        return os.path.normcase(os.path.abspath(file_path))
+
+    def load(self, file_path):
+        stat = os.stat(file_path)
+        with self.lock:
+            row = self.connect().execute('SELECT size, mtime, version, data FROM files WHERE path = ?',
+                                         (self.get_key(file_path),)).fetchone()
+        if row is None or tuple(row[0:3]) != (stat.st_size, stat.st_mtime_ns, CACHE_VERSION):
+            return None
+        try:
+            return pickle.loads(zlib.decompress(row[3]))
+        except Exception:
+            return None
+
+    def save(self, file_path, value):
+        stat = os.stat(file_path)
+        data = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        with self.lock:
+            connection = self.connect()
+            connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                               (self.get_key(file_path), stat.st_size, stat.st_mtime_ns, CACHE_VERSION, data))
+            connection.commit()
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
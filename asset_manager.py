@@ -1,13 +1,90 @@
 from PIL import Image
 from mesh import Mesh
 from asset import Asset, PRP
+from dds import DDSImage, parse_dds, read_rgba, read_dimensions
+from cache import LRUCache
+from mesh_cache import MeshDiskCache, CACHE_FOLDER
+from asset_cache import AssetDiskCache, get_user_cache_path
+from catalogue import FileCatalogue, MESH_LOD, normalize_path
+from loading import LoadProgress, LoadCancelled
 import os
+import mmap
+import sqlite3
+from contextlib import contextmanager
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import shared_memory
 import lxml.etree as etree
 from anno_rdm_converter import rdm as rdm_conv
 
-def open_file(file_path):
+# Number of lower resolution variants of a texture looked for
+MAX_TEXTURE_LEVELS = 8
+# Number of threads loading the levels of detail of the meshes requested by the renderer
+LOD_WORKERS = 2
+# Default memory budgets of the caches in bytes
+MESH_CACHE_SIZE = 512 * 2 ** 20
+TEXTURE_CACHE_SIZE = 1024 * 2 ** 20
+# Number of parsed cfg and prp files kept in cache
+FILE_CACHE_ENTRIES = 4096
+
+
+def map_file(file_path):
+    """Map a file in memory: only the pages actually read are loaded. Stays mapped while something references it."""
     with open(file_path, 'rb') as f:
-        return f.read()
+        if os.fstat(f.fileno()).st_size == 0:
+            # Empty files can't be mapped
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+@contextmanager
+def mapped_file(file_path):
+    """Map a file in memory for the duration of a with block"""
+    data = map_file(file_path)
+    try:
+        yield data
+    finally:
+        if isinstance(data, mmap.mmap):
+            try:
+                data.close()
+            except BufferError:
+                # Something still references the mapped memory, it is unmapped when released
+                pass
+
+
+def decode_image(path, name, height, width):
+    """Decode an image to RGBA into the shared memory block created by the parent process. Runs in a worker process."""
+    with Image.open(path) as im:
+        if (im.height, im.width) != (height, width):
+            raise ValueError("image size doesn't match the dds header")
+        buffer = im.convert("RGBA").tobytes()
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        shm.buf[:len(buffer)] = buffer
+    finally:
+        shm.close()
+    return height, width
+
+
+def create_image_block(height, width):
+    """Shared memory block for an RGBA image, the block size may be rounded up to pages"""
+    return shared_memory.SharedMemory(create=True, size=max(height * width * 4, 1))
+
+
+def release_image_block(shm):
+    shm.close()
+    shm.unlink()
+
+
+def receive_image(shm, future):
+    """Copy the image decoded by a worker and release its block, also when the decoding failed"""
+    try:
+        height, width = future.result()
+        data = bytes(shm.buf[:height * width * 4])
+    finally:
+        release_image_block(shm)
+    return DDSImage(data, height, width, "RGBA")
+
 
 class AssetManager:
     def __init__(self):
@@ -17,99 +94,441 @@ class AssetManager:
         self.file_path = ''
         self.main_rdm_model = None
         self.main_asset = None
+        # Number of threads loading the dependencies of a cfg file, 1 loads them one after another
+        self.max_workers = 8
+        self.lock = threading.Lock()
+        # Number of processes decoding the textures of a cfg file to RGBA, 0 decodes them in the loading threads.
+        # Used only when compressed_textures is False, main.py --texture-processes N sets both
+        self.texture_processes = 0
+        self.process_pool = None
+        # Keep block compressed dds textures as they are, the renderer uploads them directly
+        self.compressed_textures = True
+        # Show the lowest resolution level of the textures first, and load the higher ones in background.
+        # Set by main.py --stream-textures
+        self.stream_textures = False
+        # Incremented when the data is deleted, to stop the streaming of the previous file
+        self.stream_generation = 0
+        # Store the decoded meshes in the data folder and the parsed cfg/prp files in the user cache folder, and read
+        # them from there next time
+        self.use_disk_cache = True
+        # The parsed files of all the data folders are in one database of the user cache folder
+        self.asset_cache_path = get_user_cache_path('assets.sqlite')
+        self.asset_cache = None
+        # Index of the files of the data and fallback folders, used to resolve the paths
+        self.catalogue = None
+        # Levels of detail of each mesh found in the catalogue, by mesh filename
+        self.mesh_lods = {}
+        # Meshes requested by the renderer, loaded in background by the lod pool
+        self.requested_meshes = set()
+        self.lod_pool = None
+        # Files reported missing, each one is reported once until the data folder changes or is scanned again
+        self.missing_files = set()
+        self.rescan_thread = None
+        # Progress of the file being loaded, and of the last file selected (loaded once the previous load stops)
+        self.progress = LoadProgress()
+        self.latest_progress = self.progress
+        self.loading_thread = None
 
-        # a dictionnary of all the meshes (rdm files). keys are the mesh relative path+filename
-        self.meshes = {}
-        # a dictionnary of all the textures (dds). keys are the texture relative path+filename
-        self.textures = {}
-        # a dictionnary of all the su-assets (cfg files). keys are the cfg file relative path+filename
-        self.sub_assets = {}
-        # a dictionnary of all the props (prp files). keys are the cfg file relative path+filename
-        self.props = {}
+        # Caches are kept when an other file is loaded, and evict the least recently used entries
+        # a cache of all the meshes (rdm files). keys are the mesh relative path+filename
+        self.meshes = LRUCache(MESH_CACHE_SIZE)
+        # a cache of all the textures (dds). keys are the texture relative path+filename
+        self.textures = LRUCache(TEXTURE_CACHE_SIZE)
+        # a cache of all the su-assets (cfg files). keys are the cfg file relative path+filename
+        self.sub_assets = LRUCache(FILE_CACHE_ENTRIES)
+        # a cache of all the props (prp files). keys are the cfg file relative path+filename
+        self.props = LRUCache(FILE_CACHE_ENTRIES)
 
     def delete_data(self):
+        self.stream_generation += 1
         self.main_rdm_model = None
         self.main_asset = None
-        self.meshes = {}
-        self.textures = {}
-        self.sub_assets = {}
-        self.props = {}
+        self.after_deleting()
+
+    def clear_cache(self):
+        self.meshes.clear()
+        self.textures.clear()
+        self.sub_assets.clear()
+        self.props.clear()
+
+    def set_cache_size(self, meshes=MESH_CACHE_SIZE, textures=TEXTURE_CACHE_SIZE):
+        """Set the memory budget in bytes of the mesh and texture caches"""
+        self.meshes.set_max_size(meshes)
+        self.textures.set_max_size(textures)
+
+    def cache_stats(self):
+        return {'meshes': self.meshes.stats(), 'textures': self.textures.stats(), 'sub_assets': self.sub_assets.stats(),
+                'props': self.props.stats()}
+
+    def print_cache_stats(self):
+        for name, stats in self.cache_stats().items():
+            print("{}: {hits} hits, {misses} misses, {evictions} evictions, {entries} entries, {size} size".format(
+                name, **stats))
 
     #  File loading and parsing
+    def after_main_loaded(self):
+        # The main file is parsed, its dependencies are still loading
+        if self.window is not None:
+            self.window.on_main_loaded()
+
     def after_loading(self):
         if self.window is not None:
             self.window.on_file_load()
 
+    def after_texture_update(self):
+        if self.window is not None:
+            self.window.on_texture_update()
+
+    def after_deleting(self):
+        if self.window is not None:
+            self.window.on_data_deleted()
+
+    def after_progress(self, progress):
+        if self.window is not None:
+            self.window.on_load_progress(progress)
+
     def set_data_path(self, path):
         self.data_path = path
+        self.clear_cache()
+        if self.asset_cache is not None:
+            self.asset_cache.close()
+            self.asset_cache = None
+        self.catalogue = None
+        self.mesh_lods = {}
+        self.requested_meshes = set()
+        self.missing_files = set()
         print("Data path:", path)
 
+    def rescan_data_folder(self):
+        """Build the file catalogue again, after files were added or removed in the data folder"""
+        catalogue = self.get_catalogue()
+        catalogue.scan()
+        catalogue.save()
+        self.mesh_lods = {}
+        self.requested_meshes = set()
+        self.missing_files = set()
+        print(len(catalogue), "files in the data folder")
+
+    def rescan_in_background(self):
+        """Scan the data folder in a new thread, files are resolved with the previous catalogue until it's done"""
+        if self.rescan_thread is not None and self.rescan_thread.is_alive():
+            return
+        self.rescan_thread = threading.Thread(target=self.rescan_data_folder, daemon=True)
+        self.rescan_thread.start()
+
     def set_file_path(self, path):
         self.file_path = path
 
-    def load_main_file(self):
+    def load_in_background(self, filename):
+        """Load a file in a new thread. The file being loaded is cancelled, it stops after the files being read"""
+        self.latest_progress.cancel()
+        progress = LoadProgress(self.after_progress)
+        self.latest_progress = progress
+        thread = threading.Thread(target=self.run_loading, args=(filename, progress, self.loading_thread),
+                                  daemon=True)
+        self.loading_thread = thread
+        thread.start()
+
+    def run_loading(self, filename, progress, previous_thread):
+        # Files are loaded one after the other, two loads never fill the caches at the same time
+        if previous_thread is not None:
+            previous_thread.join()
+        if progress.cancelled:
+            return
+        self.set_file_path(filename)
+        self.load_main_file(progress)
+
+    def load_main_file(self, progress=None):
         formats = ['.cfg', '.rdm']# We can only load cfg and rdm files atm
         filename = self.file_path
         _, ext = os.path.splitext(filename)
         if ext not in formats:
             print("Format not supported")
             return None
+        self.progress = progress if progress is not None else LoadProgress()
         self.delete_data()
+        self.progress.add_files()
         try:
+            self.progress.check_cancelled()
             if ext == '.cfg':
                 self.parse_main_cfg(filename)
             elif ext == '.rdm':
                 self.parse_main_rdm(filename)
+                self.progress.file_done(self.main_rdm_model)
+                self.after_main_loaded()
+        except LoadCancelled:
+            print("Loading cancelled:", filename)
+            self.progress.report(force=True)
         except Exception as e:
             print(e)
         else:
             print("File loaded and parsed")
+            self.print_cache_stats()
+            self.progress.finish()
             self.after_loading()
+            self.start_texture_streaming()
 
 
     def parse_main_rdm(self, filename):
-        data = open_file(filename)
-        rdm_file = rdm_conv.RDMFile.parse(data)
-        self.main_rdm_model = Mesh.from_rdm(rdm_file)
+        with mapped_file(filename) as data:
+            rdm_file = rdm_conv.RDMFile.parse(data)
+            self.main_rdm_model = Mesh.from_rdm(rdm_file)
+            del rdm_file
 
     def parse_main_cfg(self, filename):
-        self.parse_cfg_file(filename, is_main=True)
+        if self.max_workers > 1:
+            self.load_cfg_tree(filename)
+        else:
+            self.parse_cfg_file(filename, is_main=True)
+
+    def get_cache_path(self, name):
+        return os.path.join(self.data_path, CACHE_FOLDER, name)
 
+    def disk_cache_enabled(self):
+        # Nothing is written if the data folder doesn't exist
+        return self.use_disk_cache and os.path.isdir(self.data_path)
 
-    def parse_rdm_file(self, filename):
-        if filename not in self.meshes.keys():
-            data = open_file(self.data_path+filename)
+    def get_asset_cache(self):
+        with self.lock:
+            if self.asset_cache is None:
+                self.asset_cache = AssetDiskCache(self.asset_cache_path)
+            return self.asset_cache
+
+    def get_catalogue(self):
+        with self.lock:
+            if self.catalogue is None:
+                roots = [self.data_path]
+                if self.fallback_path and os.path.abspath(self.fallback_path) != os.path.abspath(self.data_path):
+                    roots.append(self.fallback_path)
+                # Nothing is written if the data folder doesn't exist
+                path = self.get_cache_path('catalogue.json') if os.path.isdir(self.data_path) else None
+                self.catalogue = FileCatalogue.open(roots, path)
+            return self.catalogue
+
+    def resolve_path(self, filename):
+        """Path of a file given relative to the data folder, looked for in the fallback folder too. None if missing"""
+        path = self.get_catalogue().resolve(filename)
+        if path is None:
+            key = normalize_path(filename)
+            with self.lock:
+                reported = key in self.missing_files
+                self.missing_files.add(key)
+            if not reported:
+                print("file not found: ", filename)
+        return path
+
+    def read_xml(self, path, from_tree, parser=None):
+        """Parse a cfg or prp file with from_tree, or load the parsed object from the disk cache"""
+        if not self.disk_cache_enabled():
+            return from_tree(etree.parse(path, parser=parser))
+        asset_cache = self.get_asset_cache()
+        try:
+            value = asset_cache.load(path)
+        except (OSError, sqlite3.Error) as e:
+            print("can't read the asset cache", e)
+            value = None
+        if value is None:
+            value = from_tree(etree.parse(path, parser=parser))
+            try:
+                asset_cache.save(path, value)
+            except (OSError, sqlite3.Error) as e:
+                print("can't write the asset cache", e)
+        return value
+
+    # Readers: read and parse one file, without storing it
+    def read_rdm(self, filename, vertex_format=None):
+        path = self.resolve_path(filename)
+        if path is None:
+            return None
+        use_disk_cache = self.disk_cache_enabled()
+        if use_disk_cache:
+            mesh_cache = MeshDiskCache(self.get_cache_path('meshes'))
+            key = mesh_cache.get_key(filename, path)
+            mesh = mesh_cache.load(key, vertex_format)
+            if mesh is not None:
+                return mesh
+        with mapped_file(path) as data:
             rdm_file = rdm_conv.RDMFile.parse(data)
-            self.meshes[filename] = Mesh.from_rdm(rdm_file)
+            mesh = Mesh.from_rdm(rdm_file, vertex_format)
+            del rdm_file
+        if use_disk_cache:
+            try:
+                mesh_cache.save(key, mesh, filename)
+            except OSError as e:
+                print("can't write the mesh cache", e)
+        return mesh
+
+    def read_prp(self, filename):
+        path = self.resolve_path(filename)
+        if path is None:
+            return None
+        parser = etree.XMLParser(recover=True)
+        return self.read_xml(path, PRP.from_tree, parser=parser)
+
+    def read_cfg(self, filename, is_main=False):
+        if is_main:
+            return self.read_xml(filename, Asset.from_tree)
+        path = self.resolve_path(filename)
+        if path is None:
+            return None
+        return self.read_xml(path, Asset.from_tree)
+
+    def read_texture(self, filename):
+        if self.get_texture_file(filename) is None:
+            return None
+        level = 0
+        if self.stream_textures:
+            # Start with the smallest level, stream_texture_levels loads the others later
+            levels = self.find_texture_levels(filename)
+            if levels:
+                level = levels[-1]
+        texture = self.load_dds(self.get_texture_file(filename, level))
+        if texture:
+            texture.level = level
+        return texture
+
+    @staticmethod
+    def get_texture_file(filename, level=0):
+        # Textures are stored as dds files with lower resolution variants: _0.dds (full resolution), _1.dds...
+        prefix, ext = os.path.splitext(filename)
+        if ext == '.dds':
+            return prefix+'_{}.dds'.format(level)
+        elif ext == '.psd':
+            # Maybe try to find psd file first
+            return prefix+'_{}.dds'.format(level)
+        elif ext == '.png':
+            # Maybe try to find psd file first
+            return prefix+'_{}.dds'.format(level)
+        else:
+            print("texture format not supported: "+filename)
+            return None
+
+    def find_texture_levels(self, filename):
+        """Levels of the texture found in the catalogue, from 0 up to the first missing one"""
+        prefix = self.get_texture_file(filename)[:-len('_0.dds')]
+        levels = []
+        for level in self.get_catalogue().get_texture_levels(prefix):
+            if level != len(levels) or level >= MAX_TEXTURE_LEVELS:
+                break
+            levels.append(level)
+        return levels
+
+    def find_mesh_lods(self, filename):
+        """Filenames of the levels of detail of a _lodN.rdm mesh found in the catalogue, the most detailed first.
+        Empty for the other meshes"""
+        lods = self.mesh_lods.get(filename, None)
+        if lods is None:
+            lods = []
+            match = MESH_LOD.match(filename)
+            if match:
+                prefix, own_level = match.group(1), int(match.group(2))
+                lods = [filename if level == own_level else prefix + '_lod{}.rdm'.format(level)
+                        for level in self.get_catalogue().get_mesh_lods(prefix)]
+            self.mesh_lods[filename] = lods
+        return lods
+
+    def request_mesh(self, filename, vertex_format=None):
+        """Load a mesh in background if it isn't loaded, the window is refreshed once it is stored"""
+        with self.lock:
+            if filename in self.requested_meshes or self.meshes.has(filename):
+                return
+            self.requested_meshes.add(filename)
+            if self.lod_pool is None:
+                self.lod_pool = ThreadPoolExecutor(max_workers=LOD_WORKERS)
+        self.lod_pool.submit(self.load_requested_mesh, filename, vertex_format)
+
+    def wait_requested_meshes(self):
+        """Wait until the meshes requested so far are loaded"""
+        with self.lock:
+            pool = self.lod_pool
+            self.lod_pool = None
+        if pool is not None:
+            pool.shutdown()
+
+    def load_requested_mesh(self, filename, vertex_format):
+        try:
+            mesh = self.read_rdm(filename, vertex_format)
+        except Exception as e:
+            print("can't load ", filename, e)
+            return
+        if mesh is None:
+            # Stays requested, it isn't read again
+            return
+        self.store('rdm', filename, mesh)
+        with self.lock:
+            # Requested again if the cache evicts it
+            self.requested_meshes.discard(filename)
+        self.after_loading()
+
+    def start_texture_streaming(self):
+        if not self.stream_textures:
+            return
+        thread = threading.Thread(target=self.stream_texture_levels, args=(self.stream_generation,), daemon=True)
+        thread.start()
+
+    def stream_texture_levels(self, generation):
+        """Replace each texture by its next higher resolution level, until all textures are at level 0"""
+        finished = set()
+        while True:
+            upgraded = False
+            for filename in list(self.textures.keys()):
+                # Stop when an other file is loaded
+                if generation != self.stream_generation:
+                    return
+                texture = self.textures.get(filename, None)
+                if texture is None or texture.level == 0 or filename in finished:
+                    continue
+                level = texture.level - 1
+                better = self.load_dds(self.get_texture_file(filename, level))
+                if better is None:
+                    finished.add(filename)
+                    continue
+                better.level = level
+                self.store('texture', filename, better)
+                self.after_texture_update()
+                upgraded = True
+            if not upgraded:
+                return
+
+    def parse_rdm_file(self, filename, vertex_format=None):
+        self.progress.check_cancelled()
+        mesh = None
+        if filename not in self.meshes:
+            mesh = self.read_rdm(filename, vertex_format)
+            if mesh is not None:
+                self.meshes[filename] = mesh
+        self.progress.file_done(mesh)
 
     def parse_prp_file(self, filename):
-        if filename not in self.props.keys():
-            parser = etree.XMLParser(recover=True)
-            root = etree.parse(self.data_path+filename, parser=parser)
-            prop = PRP.from_tree(root)
-            self.props[filename] = prop
-            if prop.mesh_filename not in self.meshes.keys():
-                self.parse_rdm_file(prop.mesh_filename)
-            textures = prop.get_textures_to_load()
-            if textures:
+        self.progress.check_cancelled()
+        if filename not in self.props:
+            prop = self.read_prp(filename)
+            if prop is not None:
+                self.props[filename] = prop
+                textures = prop.get_textures_to_load()
+                self.progress.add_files(1 + len(textures))
+                self.parse_rdm_file(prop.mesh_filename, prop.vertex_format)
                 for tex in textures:
                     self.load_texture(tex)
-        # Parse models and materials...
+        self.progress.file_done()
 
     # Recursive parsing
     def parse_cfg_file(self, filename, is_main=False):
-        # We check if this cfg have already been parsed
-        if filename in self.sub_assets.keys():
+        self.progress.check_cancelled()
+        # We check if this cfg have already been parsed. The main file is always parsed again, it may have been edited
+        if not is_main and filename in self.sub_assets:
+            self.progress.file_done()
             return
-        if is_main:
-            root = etree.parse(filename)
-        else:
-            root = etree.parse(self.data_path+filename)
-
-        asset = Asset.from_tree(root)
+        asset = self.read_cfg(filename, is_main)
+        self.progress.file_done()
+        if asset is None:
+            return
+        self.sub_assets[filename] = asset
         if is_main:
             self.main_asset = asset
-        self.sub_assets[filename] = asset
+            self.after_main_loaded()
+        self.progress.add_files(len(asset.files) + len(asset.get_props()) + len(asset.get_meshes_to_load()) +
+                                len(asset.get_textures_to_load()))
         # We first parse all cfg files
         for cfg in asset.files:
             self.parse_cfg_file(cfg.filename)
@@ -118,52 +537,185 @@ class AssetManager:
             self.parse_prp_file(prp.filename)
         # We now parse all models
         for rdm in asset.get_meshes_to_load():
-            self.parse_rdm_file(rdm.filename)
+            self.parse_rdm_file(rdm.filename, rdm.get_vertex_format())
         # We now parse all textures
         for tex in asset.get_textures_to_load():
             self.load_texture(tex)
 
     def load_texture(self, filename):
-        if filename is None:
-            return
-        if filename in self.textures.keys():
+        self.progress.check_cancelled()
+        tex = None
+        if filename is not None and filename not in self.textures:
+            tex = self.read_texture(filename)
+            if tex:
+                self.textures[filename] = tex
+        self.progress.file_done(tex)
+
+    # Parallel parsing
+    # Each task reads one file, stores it and returns the files it depends on as (kind, filename, argument).
+    # Tasks started after a cancellation stop before reading their file
+    def get_storage(self, kind):
+        return {'cfg': self.sub_assets, 'prp': self.props, 'rdm': self.meshes, 'texture': self.textures}[kind]
+
+    def store(self, kind, filename, value):
+        if value is None:
             return
-        prefix, ext = os.path.splitext(filename)
-        if ext == '.dds':
-            tex = self.load_dds(prefix+'_0.dds')
-        elif ext == '.psd':
-            # Maybe try to find psd file first
-            tex = self.load_dds(prefix+'_0.dds')
-        elif ext == '.png':
-            # Maybe try to find psd file first
-            tex = self.load_dds(prefix+'_0.dds')
-        else:
-            tex = None
-            print("texture format not supported: "+filename)
-        if tex:
-            self.textures[filename] = tex
+        with self.lock:
+            self.get_storage(kind)[filename] = value
+
+    def load_cfg_task(self, filename, is_main=False):
+        self.progress.check_cancelled()
+        asset = self.read_cfg(filename, is_main)
+        self.progress.file_done()
+        if asset is None:
+            return []
+        self.store('cfg', filename, asset)
+        if is_main:
+            self.main_asset = asset
+            self.after_main_loaded()
+        dependencies = [('cfg', cfg.filename, False) for cfg in asset.files]
+        dependencies += [('prp', prp.filename, None) for prp in asset.get_props()]
+        dependencies += [('rdm', rdm.filename, rdm.get_vertex_format()) for rdm in asset.get_meshes_to_load()]
+        dependencies += [('texture', tex, None) for tex in asset.get_textures_to_load()]
+        return dependencies
+
+    def load_prp_task(self, filename, _=None):
+        self.progress.check_cancelled()
+        prop = self.read_prp(filename)
+        self.progress.file_done()
+        if prop is None:
+            return []
+        self.store('prp', filename, prop)
+        dependencies = [('rdm', prop.mesh_filename, prop.vertex_format)]
+        dependencies += [('texture', tex, None) for tex in prop.get_textures_to_load()]
+        return dependencies
+
+    def load_rdm_task(self, filename, vertex_format=None):
+        self.progress.check_cancelled()
+        mesh = self.read_rdm(filename, vertex_format)
+        self.store('rdm', filename, mesh)
+        self.progress.file_done(mesh)
+        return []
+
+    def load_texture_task(self, filename, _=None):
+        self.progress.check_cancelled()
+        texture = self.read_texture(filename)
+        self.store('texture', filename, texture)
+        self.progress.file_done(texture)
+        return []
+
+    def get_process_pool(self):
+        if self.process_pool is None:
+            self.process_pool = ProcessPoolExecutor(max_workers=self.texture_processes)
+        return self.process_pool
+
+    def decode_in_processes(self):
+        return self.texture_processes > 0 and not self.compressed_textures
+
+    def submit_texture(self, filename):
+        """Decode a dds texture in the process pool, returns the future and its shared memory block,
+        or None to load it in a thread"""
+        dds_file = self.get_texture_file(filename)
+        if dds_file is None:
+            return None
+        path = self.resolve_path(dds_file)
+        if path is None:
+            return None
+        try:
+            dimensions = read_dimensions(path)
+        except OSError:
+            return None
+        if dimensions is None:
+            return None
+        shm = create_image_block(*dimensions)
+        try:
+            return self.get_process_pool().submit(decode_image, path, shm.name, *dimensions), shm
+        except Exception:
+            release_image_block(shm)
+            raise
+
+    def receive_texture(self, filename, shm, future):
+        texture = None
+        try:
+            texture = receive_image(shm, future)
+            self.store('texture', filename, texture)
+        except Exception:
+            print("can't open ", self.get_texture_file(filename))
+        self.progress.file_done(texture)
+
+    def load_cfg_tree(self, filename):
+        """Load a cfg file and all its dependencies concurrently on a pool of max_workers threads"""
+        tasks = {'cfg': self.load_cfg_task, 'prp': self.load_prp_task, 'rdm': self.load_rdm_task,
+                 'texture': self.load_texture_task}
+        requested = {('cfg', filename)}
+        # Textures decoded in the process pool and their shared memory blocks, by future
+        decoding = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            pending = {pool.submit(self.load_cfg_task, filename, True)}
+            try:
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    self.progress.check_cancelled()
+                    for future in done:
+                        if future in decoding:
+                            name, shm = decoding.pop(future)
+                            self.receive_texture(name, shm, future)
+                            continue
+                        # Only this thread submits tasks, so each file is requested once
+                        dependencies = future.result()
+                        self.progress.add_files(len(dependencies))
+                        for kind, name, argument in dependencies:
+                            if name is None or (kind, name) in requested or name in self.get_storage(kind):
+                                self.progress.file_done()
+                                continue
+                            requested.add((kind, name))
+                            submitted = self.submit_texture(name) if kind == 'texture' and \
+                                self.decode_in_processes() else None
+                            if submitted is not None:
+                                texture_future, shm = submitted
+                                decoding[texture_future] = (name, shm)
+                                pending.add(texture_future)
+                            else:
+                                pending.add(pool.submit(tasks[kind], name, argument))
+            except Exception:
+                # Tasks not started yet are cancelled, the pool waits for the running ones
+                for future in pending:
+                    if future not in decoding:
+                        future.cancel()
+                for future, (_, shm) in decoding.items():
+                    if future.cancel():
+                        release_image_block(shm)
+                    else:
+                        # The worker may still write in the block
+                        future.add_done_callback(lambda _, shm=shm: release_image_block(shm))
+                raise
+
+    def close(self):
+        self.latest_progress.cancel()
+        if self.asset_cache is not None:
+            self.asset_cache.close()
+        if self.process_pool is not None:
+            self.process_pool.shutdown()
+            self.process_pool = None
+        if self.lod_pool is not None:
+            self.lod_pool.shutdown(cancel_futures=True)
+            self.lod_pool = None
 
     def load_dds(self, file_path):
-        path = self.data_path + file_path
+        path = self.resolve_path(file_path)
+        if path is None:
+            return None
         try:
-            im = Image.open(path)
-            converted = im.convert("RGBA")
-            buffer = converted.tobytes()
-            height = im.height
-            width = im.width
-            format = "RGBA"
-            # len(self.buffer) / (image.width * image.height)
-            im.close()
-            dds_file = DDSImage(buffer, height, width, format)
+            dds_file = None
+            if self.compressed_textures:
+                # Read rather than mapped: a map would keep the file open while the texture is cached. The whole
+                # file is read at once, the mip levels are views of it
+                with open(path, 'rb') as f:
+                    dds_file = parse_dds(f.read(), path)
+            if dds_file is None:
+                dds_file = read_rgba(path)
         except:
             print("can't open ", path)
         else:
             return dds_file
 
-
-class DDSImage:
-    def __init__(self, data, height, width, format):
-        self.data = data
-        self.height = height
-        self.width = width
-        self.format = format
\ No newline at end of file
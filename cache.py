@@ -0,0 +1,109 @@
+import threading
+from collections import OrderedDict
+
+
+def sizeof(value):
+    """Memory used by a cached value: its nbytes if it has one, else it counts as one entry"""
+    return getattr(value, 'nbytes', 1)
+
+
+class LRUCache:
+    """A dictionary with a size budget, evicting the least recently used entries first.
+    'key in cache' counts a hit or a miss, get() and [] mark the entry as recently used.
+    has() checks a key without counting nor marking it, for internal checks."""
+
+    def __init__(self, max_size, sizeof=sizeof):
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Incremented each time an entry is added or removed
+        self.version = 0
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.lock = threading.RLock()
+
+    def __contains__(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return True
+            self.misses += 1
+            return False
+
+    def has(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def __getitem__(self, key):
+        with self.lock:
+            value = self.entries[key]
+            self.entries.move_to_end(key)
+            return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.sizes[key]
+            self.entries[key] = value
+            self.version += 1
+            self.entries.move_to_end(key)
+            self.sizes[key] = self.sizeof(value)
+            self.size += self.sizes[key]
+            self.evict(keep=key)
+
+    def __delitem__(self, key):
+        with self.lock:
+            del self.entries[key]
+            self.version += 1
+            self.size -= self.sizes.pop(key)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+            return self[key]
+
+    def keys(self):
+        with self.lock:
+            return list(self.entries.keys())
+
+    def values(self):
+        with self.lock:
+            return list(self.entries.values())
+
+    def items(self):
+        with self.lock:
+            return list(self.entries.items())
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.version += 1
+            self.sizes.clear()
+            self.size = 0
+
+    def set_max_size(self, max_size):
+        with self.lock:
+            self.max_size = max_size
+            self.evict()
+
+    def evict(self, keep=None):
+        with self.lock:
+            for key in list(self.entries.keys()):
+                if self.size <= self.max_size:
+                    break
+                if key == keep:
+                    continue
+                del self[key]
+                self.evictions += 1
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'entries': len(self),
+                'size': self.size}
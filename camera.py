@@ -0,0 +1,76 @@
+import numpy as np
+from math import tan, radians, cos, sin
+from scene import translation_matrix
+
+
+def frustum_matrix(left, right, bottom, top, near, far):
+    """Same matrix as glFrustum"""
+    return np.array([[2 * near / (right - left), 0, (right + left) / (right - left), 0],
+                     [0, 2 * near / (top - bottom), (top + bottom) / (top - bottom), 0],
+                     [0, 0, -(far + near) / (far - near), -2 * far * near / (far - near)],
+                     [0, 0, -1, 0]])
+
+
+def frustum_planes(matrix):
+    """Planes (a, b, c, d) of the frustum of a projection @ view matrix, ax + by + cz + d >= 0 inside.
+    The normals are unit vectors, d is the distance to the plane"""
+    planes = np.array([matrix[3] + matrix[0], matrix[3] - matrix[0],
+                       matrix[3] + matrix[1], matrix[3] - matrix[1],
+                       matrix[3] + matrix[2], matrix[3] - matrix[2]])
+    return planes / np.linalg.norm(planes[:, 0:3], axis=1)[:, None]
+
+
+def rotation_matrix(angle, x, y, z):
+    """Same matrix as glRotatef, angle in degrees around a unit axis"""
+    c = cos(radians(angle))
+    s = sin(radians(angle))
+    axis = np.array([x, y, z], dtype=np.float64)
+    cross = np.array([[0, -z, y], [z, 0, -x], [-y, x, 0]])
+    matrix = np.eye(4)
+    matrix[0:3, 0:3] = c * np.eye(3) + s * cross + (1 - c) * np.outer(axis, axis)
+    return matrix
+
+
+class Camera:
+    """Projection and view matrices of the viewer, computed with NumPy.
+    The fixed-function renderer loads them with glLoadMatrixf, the core profile renderer uses them in its shaders."""
+
+    def __init__(self):
+        self.width = 1
+        self.height = 1
+        self.fov = 20
+        self.projection = np.eye(4)
+        self.view = np.eye(4)
+
+    def set_view(self, width, height, angle_x, angle_y, zoom, trans_x, trans_y, fov=20, near=1., far=1000.):
+        """Orbit camera looking at the origin: rotations in degrees, zoom and translations in world units"""
+        self.width = max(width, 1)
+        self.height = max(height, 1)
+        self.fov = fov
+        loc_y = tan(radians(fov)) * near
+        loc_x = loc_y / self.height * self.width
+        # The x axis is mirrored
+        self.projection = np.diag([-1., 1., 1., 1.]) @ frustum_matrix(-loc_x, loc_x, -loc_y, loc_y, near, far)
+        self.view = translation_matrix(0, 0, zoom - 10) @ translation_matrix(trans_x, trans_y, 0) @ \
+            rotation_matrix(angle_y, 1., 0., 0.) @ rotation_matrix(-angle_x, 0., 1., 0.)
+
+    @staticmethod
+    def to_gl(matrix):
+        """Column-major float32 matrix, for glLoadMatrixf and the uniforms"""
+        return np.ascontiguousarray(matrix.T, dtype=np.float32)
+
+    def gl_projection(self):
+        return Camera.to_gl(self.projection)
+
+    def gl_view(self):
+        return Camera.to_gl(self.view)
+
+    def projected_sizes(self, centers, radii):
+        """Approximate heights in pixels of spheres on the screen, infinite for the spheres around the camera"""
+        depths = -(centers @ self.view[2, 0:3] + self.view[2, 3])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sizes = radii / (depths * tan(radians(self.fov))) * self.height
+        return np.where(depths > radii, sizes, np.inf)
+
+    def get_frustum_planes(self):
+        return frustum_planes(self.projection @ self.view)
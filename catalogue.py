@@ -0,0 +1,112 @@
+import json
+import os
+import re
+from mesh_cache import CACHE_FOLDER
+
+# Increment when the stored catalogue layout changes
+CATALOGUE_VERSION = 1
+# Texture variants: name_0.dds (full resolution), name_1.dds...
+TEXTURE_LEVEL = re.compile(r'^(.*)_(\d+)\.dds$')
+# Level of detail variants of the meshes: name_lod0.rdm (most detailed), name_lod1.rdm...
+MESH_LOD = re.compile(r'^(.*)_lod(\d+)\.rdm$', re.IGNORECASE)
+
+
+def normalize_path(filename):
+    """Key of a file in the catalogue: lower case, / separators, relative"""
+    return filename.replace('\\', '/').lower().lstrip('/')
+
+
+class FileCatalogue:
+    """Index of the files in the data folder and the fallback folder, built once and stored on disk.
+    Paths of the cfg files are resolved with it instead of probing the filesystem."""
+
+    def __init__(self, roots, path=None):
+        # Folders scanned, the first ones have priority
+        self.roots = [os.path.abspath(r) for r in roots]
+        # File the catalogue is stored in
+        self.path = path
+        # Absolute path of the files, keys are normalized relative paths
+        self.files = {}
+        # Available levels of the textures, keys are normalized paths without the _N.dds suffix
+        self.texture_levels = {}
+        # Available levels of detail of the meshes, keys are normalized paths without the _lodN.rdm suffix
+        self.mesh_lods = {}
+
+    @staticmethod
+    def open(roots, path=None):
+        """Load the stored catalogue, or build it if there isn't one for these folders"""
+        catalogue = FileCatalogue(roots, path)
+        if not catalogue.load():
+            catalogue.scan()
+            catalogue.save()
+        return catalogue
+
+    def scan(self):
+        files = {}
+        for root in reversed(self.roots):
+            for folder, dirs, filenames in os.walk(root):
+                if CACHE_FOLDER in dirs:
+                    dirs.remove(CACHE_FOLDER)
+                for name in filenames:
+                    file_path = os.path.join(folder, name)
+                    files[normalize_path(os.path.relpath(file_path, root))] = file_path
+        self.files = files
+        self.index_levels()
+
+    def index_levels(self):
+        self.texture_levels = FileCatalogue.find_levels(self.files.keys(), TEXTURE_LEVEL)
+        self.mesh_lods = FileCatalogue.find_levels(self.files.keys(), MESH_LOD)
+
+    @staticmethod
+    def find_levels(keys, pattern):
+        """Sorted levels of the files matching a (prefix, level) pattern, by prefix"""
+        index = {}
+        for key in keys:
+            match = pattern.match(key)
+            if match:
+                index.setdefault(match.group(1), []).append(int(match.group(2)))
+        for levels in index.values():
+            levels.sort()
+        return index
+
+    def load(self):
+        if self.path is None:
+            return False
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get('version') != CATALOGUE_VERSION or data.get('roots') != self.roots:
+            return False
+        self.files = data['files']
+        self.index_levels()
+        return True
+
+    def save(self):
+        if self.path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'w') as f:
+                json.dump({'version': CATALOGUE_VERSION, 'roots': self.roots, 'files': self.files}, f)
+        except OSError as e:
+            print("can't write the file catalogue", e)
+
+    def resolve(self, filename):
+        """Absolute path of a file given relative to the data folder, or None if it doesn't exist"""
+        return self.files.get(normalize_path(filename), None)
+
+    def get_texture_levels(self, prefix):
+        """Sorted levels N of the existing prefix_N.dds files"""
+        return self.texture_levels.get(normalize_path(prefix), [])
+
+    def get_mesh_lods(self, prefix):
+        """Sorted levels N of the existing prefix_lodN.rdm files"""
+        return self.mesh_lods.get(normalize_path(prefix), [])
+
+    def __contains__(self, filename):
+        return normalize_path(filename) in self.files
+
+    def __len__(self):
+        return len(self.files)
@@ -0,0 +1,268 @@
+import ctypes
+from OpenGL.GL import *
+from OpenGL.GL import shaders
+from OpenGL.arrays import vbo
+from mesh import Mesh
+from asset import Asset
+from camera import rotation_matrix
+from renderer import Renderer
+from shaders import CORE_VERSION, CORE_VERTEX_SHADER, CORE_FRAGMENT_SHADER, CORE_LINE_VERTEX_SHADER, \
+    CORE_LINE_FRAGMENT_SHADER
+import numpy as np
+import math
+
+# Binding points of the uniform blocks
+CAMERA_BINDING = 0
+DRAW_BINDING = 1
+# Attribute locations of the mesh shader, the instance matrix takes 4 locations
+INSTANCE_LOCATION = 3
+
+
+def line_vertices(segments, color):
+    """Vertices of GL_LINES for a list of (start, end) points: x, y, z, r, g, b, a"""
+    vertices = []
+    for start, end in segments:
+        vertices.append(tuple(start) + color)
+        vertices.append(tuple(end) + color)
+    return vertices
+
+
+def light_marker_vertices(n_vertices=32):
+    """The light marker of the fixed-function renderer: a circle and a line in each of 3 rotated planes"""
+    rotations = [(90, 1, 0, 0), (90, 0, 1, 0), (90, 0, 0, 1)]
+    colors = [(0., 1., 0., 1.), (1., 0., 0., 1.), (0., 0., 1., 1.)]
+    vertices = []
+    for rot, color in zip(rotations, colors):
+        matrix = rotation_matrix(*rot)[0:3, 0:3]
+        circle = [(math.cos(2 * math.pi * i / n_vertices), math.sin(2 * math.pi * i / n_vertices), 0)
+                  for i in range(n_vertices)]
+        segments = [(circle[i], circle[(i + 1) % n_vertices]) for i in range(n_vertices)]
+        segments.append(((0, 0, -1), (0, 0, 1)))
+        vertices += line_vertices([(matrix @ start, matrix @ end) for start, end in segments], color)
+    return vertices
+
+
+def axes_vertices():
+    return line_vertices([((0, 0, 0), (1, 0, 0))], (1., 0., 0., 1.)) + \
+        line_vertices([((0, 0, 0), (0, 1, 0))], (0., 1., 0., 1.)) + \
+        line_vertices([((0, 0, 0), (0, 0, 1))], (0., 0., 1., 1.))
+
+
+class LineArray:
+    """Colored lines in a vertex array object, drawn with the line shader"""
+
+    def __init__(self, vertices):
+        data = np.array(vertices, dtype=np.float32)
+        self.count = len(data)
+        self.vao = glGenVertexArrays(1)
+        self.vbo = glGenBuffers(1)
+        glBindVertexArray(self.vao)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferData(GL_ARRAY_BUFFER, data.nbytes, data, GL_STATIC_DRAW)
+        glEnableVertexAttribArray(0)
+        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 28, ctypes.c_void_p(0))
+        glEnableVertexAttribArray(1)
+        glVertexAttribPointer(1, 4, GL_FLOAT, GL_FALSE, 28, ctypes.c_void_p(12))
+        glBindVertexArray(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def draw(self):
+        glBindVertexArray(self.vao)
+        glDrawArrays(GL_LINES, 0, self.count)
+
+    def delete(self):
+        glDeleteVertexArrays(1, [self.vao])
+        glDeleteBuffers(1, [self.vbo])
+
+
+class CoreRenderer(Renderer):
+    """Renderer for a core profile context: GLSL programs, a vertex array object per mesh buffer and per props group,
+    the camera and the world matrices of the draws in uniform buffers. Draws the same scenes as Renderer."""
+
+    def __init__(self, manager, camera=None):
+        super().__init__(manager, camera)
+        self.mesh_program = None
+        self.line_program = None
+        self.line_model_location = None
+        self.camera_buffer = None
+        # World matrices of the scene items, item i at the offset (i + 1) * matrix_stride, the identity first
+        self.matrix_buffer = None
+        self.matrix_stride = 64
+        self.axes = None
+        self.light_marker = None
+        # Vertex array objects of props groups whose buffers were released
+        self.released_vaos = []
+
+    def init_state(self):
+        glEnable(GL_DEPTH_TEST)
+        glEnable(GL_CULL_FACE)
+        glCullFace(GL_FRONT)
+        glClearColor(0.5, 0.7, 1, 1)
+
+    def init_shaders(self):
+        if self.mesh_program is not None:
+            return
+        mesh_fragment = shaders.compileShader(CORE_VERSION + CORE_FRAGMENT_SHADER, GL_FRAGMENT_SHADER)
+        self.mesh_program = self.compile_mesh_program(CORE_VERSION, mesh_fragment)
+        self.instance_program = self.compile_mesh_program(CORE_VERSION + "#define INSTANCED\n", mesh_fragment)
+        self.instance_location = INSTANCE_LOCATION
+        self.line_program = shaders.compileProgram(
+            shaders.compileShader(CORE_VERSION + CORE_LINE_VERTEX_SHADER, GL_VERTEX_SHADER),
+            shaders.compileShader(CORE_VERSION + CORE_LINE_FRAGMENT_SHADER, GL_FRAGMENT_SHADER))
+        glUniformBlockBinding(self.line_program, glGetUniformBlockIndex(self.line_program, 'Camera'), CAMERA_BINDING)
+        self.line_model_location = glGetUniformLocation(self.line_program, 'model')
+
+        self.camera_buffer = glGenBuffers(1)
+        glBindBuffer(GL_UNIFORM_BUFFER, self.camera_buffer)
+        glBufferData(GL_UNIFORM_BUFFER, 128, None, GL_DYNAMIC_DRAW)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+        glBindBufferBase(GL_UNIFORM_BUFFER, CAMERA_BINDING, self.camera_buffer)
+        # Offsets of glBindBufferRange are multiples of the alignment
+        alignment = glGetIntegerv(GL_UNIFORM_BUFFER_OFFSET_ALIGNMENT)
+        self.matrix_stride = (64 + alignment - 1) // alignment * alignment
+
+        self.white_texture = Renderer.create_white_texture()
+        self.axes = LineArray(axes_vertices())
+        self.light_marker = LineArray(light_marker_vertices())
+
+    @staticmethod
+    def compile_mesh_program(header, fragment_shader):
+        program = shaders.compileProgram(shaders.compileShader(header + CORE_VERTEX_SHADER, GL_VERTEX_SHADER),
+                                         fragment_shader)
+        glUniformBlockBinding(program, glGetUniformBlockIndex(program, 'Camera'), CAMERA_BINDING)
+        glUniformBlockBinding(program, glGetUniformBlockIndex(program, 'Draw'), DRAW_BINDING)
+        return program
+
+    def get_default_texture(self, group=None):
+        # Both programs sample the texture
+        return self.white_texture
+
+    def release_buffers(self):
+        # The vertex array objects of the props refer to the released buffers
+        for group in self.scene.prop_groups:
+            if group.vao is not None:
+                self.released_vaos.append(group.vao)
+                group.vao = None
+        super().release_buffers()
+
+    def delete_released_buffers(self):
+        super().delete_released_buffers()
+        if self.released_vaos:
+            glDeleteVertexArrays(len(self.released_vaos), self.released_vaos)
+        self.released_vaos = []
+
+    def release_scene(self, prop_groups):
+        for group in prop_groups:
+            if group.vao is not None:
+                glDeleteVertexArrays(1, [group.vao])
+                group.vao = None
+        super().release_scene(prop_groups)
+        if self.matrix_buffer is not None:
+            glDeleteBuffers(1, [self.matrix_buffer])
+            self.matrix_buffer = None
+
+    def get_matrix_buffer(self):
+        if self.matrix_buffer is None:
+            data = np.zeros((len(self.scene.items) + 1, self.matrix_stride // 4), dtype=np.float32)
+            data[0, 0:16] = np.eye(4, dtype=np.float32).ravel()
+            for item in self.scene.items:
+                data[item.index + 1, 0:16] = item.gl_matrix.ravel()
+            self.matrix_buffer = glGenBuffers(1)
+            glBindBuffer(GL_UNIFORM_BUFFER, self.matrix_buffer)
+            glBufferData(GL_UNIFORM_BUFFER, data.nbytes, data, GL_STATIC_DRAW)
+            glBindBuffer(GL_UNIFORM_BUFFER, 0)
+        return self.matrix_buffer
+
+    def begin_draws(self):
+        pass
+
+    def end_draws(self, instanced):
+        glBindVertexArray(0)
+
+    def use_program(self, instanced):
+        glUseProgram(self.instance_program if instanced else self.mesh_program)
+
+    def bind_buffers(self, buffer, group=None):
+        if group is None:
+            if buffer.vao is None:
+                buffer.vao = CoreRenderer.create_vao(buffer)
+            glBindVertexArray(buffer.vao)
+            return
+        if group.buffer is None:
+            group.buffer = vbo.VBO(group.instances)
+        if not group.buffer.copied:
+            # Visible props changed, the vertex array object keeps the same buffer
+            group.buffer.bind()
+            group.buffer.unbind()
+        if group.vao is None:
+            group.vao = CoreRenderer.create_vao(buffer, group.buffer)
+        glBindVertexArray(group.vao)
+
+    @staticmethod
+    def create_vao(buffer, instance_buffer=None):
+        vao = glGenVertexArrays(1)
+        glBindVertexArray(vao)
+        buffer.vbo.bind()
+        buffer.ibo.bind()
+        for location, size, offset in ((0, 3, 0), (1, 3, 12), (2, 2, 24)):
+            glEnableVertexAttribArray(location)
+            glVertexAttribPointer(location, size, GL_FLOAT, GL_FALSE, 32, ctypes.c_void_p(offset))
+        if instance_buffer is not None:
+            instance_buffer.bind()
+            for column in range(4):
+                glEnableVertexAttribArray(INSTANCE_LOCATION + column)
+                glVertexAttribPointer(INSTANCE_LOCATION + column, 4, GL_FLOAT, GL_FALSE, 64,
+                                      ctypes.c_void_p(16 * column))
+                glVertexAttribDivisor(INSTANCE_LOCATION + column, 1)
+        # The element buffer stays bound to the vertex array object
+        glBindVertexArray(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        return vao
+
+    def unbind_buffers(self, bound_buffer):
+        pass
+
+    def draw(self, buffer, group, offset, size, item):
+        if group is not None:
+            glDrawElementsInstanced(GL_TRIANGLES, size, GL_UNSIGNED_INT, ctypes.c_void_p(offset * 4),
+                                    len(group.instances))
+            return
+        slot = item.index + 1 if item is not None else 0
+        glBindBufferRange(GL_UNIFORM_BUFFER, DRAW_BINDING, self.get_matrix_buffer(), slot * self.matrix_stride, 64)
+        glDrawElements(GL_TRIANGLES, size, GL_UNSIGNED_INT, ctypes.c_void_p(offset * 4))
+
+    def render_lights(self, lights):
+        if not lights:
+            return
+        glUseProgram(self.line_program)
+        for item in lights:
+            glUniformMatrix4fv(self.line_model_location, 1, GL_FALSE, item.gl_matrix)
+            self.light_marker.draw()
+        glBindVertexArray(0)
+        glUseProgram(0)
+
+    def render(self, model, asset):
+        if not self.initialized:
+            self.initialize()
+            return
+
+        self.begin_frame()
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        glBindBuffer(GL_UNIFORM_BUFFER, self.camera_buffer)
+        glBufferSubData(GL_UNIFORM_BUFFER, 0, 64, self.camera.gl_projection())
+        glBufferSubData(GL_UNIFORM_BUFFER, 64, 64, self.camera.gl_view())
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+
+        if isinstance(model, Mesh):
+            self.render_model(self.get_buffer(self.asset_manager.file_path, model))
+        elif isinstance(asset, Asset):
+            self.render_asset(asset)
+
+        # Render arrows
+        glDisable(GL_DEPTH_TEST)
+        glUseProgram(self.line_program)
+        glUniformMatrix4fv(self.line_model_location, 1, GL_FALSE, np.eye(4, dtype=np.float32))
+        self.axes.draw()
+        glBindVertexArray(0)
+        glUseProgram(0)
+        glEnable(GL_DEPTH_TEST)
@@ -0,0 +1,99 @@
+import struct
+import numpy as np
+from PIL import Image
+
+# Size in bytes of a 4x4 block for the block compressed formats
+BLOCK_SIZES = {'BC1': 8, 'BC2': 16, 'BC3': 16, 'BC4': 8, 'BC5': 16, 'BC7': 16}
+FOURCC_FORMATS = {b'DXT1': 'BC1', b'DXT3': 'BC2', b'DXT5': 'BC3', b'ATI1': 'BC4', b'BC4U': 'BC4', b'ATI2': 'BC5',
+                  b'BC5U': 'BC5'}
+DXGI_FORMATS = {71: 'BC1', 72: 'BC1', 74: 'BC2', 75: 'BC2', 77: 'BC3', 78: 'BC3', 80: 'BC4', 83: 'BC5', 98: 'BC7',
+                99: 'BC7'}
+
+DDS_MAGIC = b'DDS '
+HEADER_SIZE = 128
+DX10_HEADER_SIZE = 20
+DDPF_FOURCC = 0x4
+
+
+class DDSImage:
+    """A texture, either decoded to RGBA or kept block compressed with its mip chain"""
+
+    def __init__(self, data, height, width, format, mipmaps=None, path=None):
+        self.data = data
+        self.height = height
+        self.width = width
+        self.format = format
+        # List of (width, height, data) for the compressed formats, starting with the full resolution
+        self.mipmaps = mipmaps
+        self.path = path
+        # Resolution level of the file: 0 for the full resolution _0.dds, 1 for _1.dds...
+        self.level = 0
+
+    @property
+    def nbytes(self):
+        if self.mipmaps:
+            return sum(len(data) for _, _, data in self.mipmaps)
+        return len(self.data)
+
+    def is_compressed(self):
+        return self.format in BLOCK_SIZES
+
+    def decompress(self):
+        """Decode the texture to RGBA, for the formats the driver can't upload"""
+        return read_rgba(self.path)
+
+
+def level_size(width, height, format):
+    return max(1, (width + 3) // 4) * max(1, (height + 3) // 4) * BLOCK_SIZES[format]
+
+
+def parse_dds(data, path=None):
+    """Read the header of a dds file. Returns a compressed DDSImage, or None if the format isn't block compressed"""
+    if len(data) < HEADER_SIZE or bytes(data[0:4]) != DDS_MAGIC:
+        return None
+    height, width, _, _, mipmap_count = struct.unpack_from('<5I', data, 12)
+    pixel_flags, fourcc = struct.unpack_from('<I4s', data, 80)
+    if not pixel_flags & DDPF_FOURCC:
+        return None
+    offset = HEADER_SIZE
+    if fourcc == b'DX10':
+        format = DXGI_FORMATS.get(struct.unpack_from('<I', data, HEADER_SIZE)[0])
+        offset += DX10_HEADER_SIZE
+    else:
+        format = FOURCC_FORMATS.get(fourcc)
+    if format is None:
+        return None
+
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    mipmaps = []
+    level_width, level_height = width, height
+    for _ in range(max(1, mipmap_count)):
+        size = level_size(level_width, level_height, format)
+        if offset + size > len(buffer):
+            break
+        mipmaps.append((level_width, level_height, buffer[offset:offset + size]))
+        offset += size
+        if level_width == 1 and level_height == 1:
+            break
+        level_width = max(1, level_width // 2)
+        level_height = max(1, level_height // 2)
+    if not mipmaps:
+        return None
+    return DDSImage(mipmaps[0][2], height, width, format, mipmaps=mipmaps, path=path)
+
+
+def read_dimensions(path):
+    """Height and width from the header of a dds file, None if it isn't a dds file"""
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE or header[0:4] != DDS_MAGIC:
+        return None
+    return struct.unpack_from('<2I', header, 12)
+
+
+def read_rgba(path):
+    with Image.open(path) as im:
+        buffer = im.convert("RGBA").tobytes()
+        height = im.height
+        width = im.width
+    return DDSImage(buffer, height, width, "RGBA", path=path)
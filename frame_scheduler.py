@@ -0,0 +1,63 @@
+import time
+from collections import deque
+
+
+class FrameScheduler:
+    """Draws a frame when something changed, instead of once per input event.
+    Requests made while a frame is pending are merged into it, and frames are spaced by at least 1 / max_fps.
+    Nothing is drawn when nothing is requested.
+
+    draw() draws a frame, call_later(delay, function) calls a function after a delay in seconds on the GUI thread.
+    Requests must be made on the GUI thread too."""
+
+    def __init__(self, draw, call_later, max_fps=60, clock=time.monotonic, history=120):
+        self.draw = draw
+        self.call_later = call_later
+        self.clock = clock
+        self.min_interval = 0.
+        self.set_max_fps(max_fps)
+        # A frame is scheduled and not drawn yet
+        self.pending = False
+        self.last_frame = None
+        # Duration of the last frames, and the time they started
+        self.frame_times = deque(maxlen=history)
+        self.frame_starts = deque(maxlen=history)
+        self.requests = 0
+        self.frames = 0
+
+    def set_max_fps(self, max_fps):
+        """0 or None doesn't limit the frame rate"""
+        self.min_interval = 1. / max_fps if max_fps else 0.
+
+    def request_frame(self):
+        self.requests += 1
+        if self.pending:
+            return
+        self.pending = True
+        delay = 0.
+        if self.last_frame is not None:
+            delay = max(0., self.last_frame + self.min_interval - self.clock())
+        self.call_later(delay, self.run_frame)
+
+    def run_frame(self):
+        self.pending = False
+        self.draw_frame()
+
+    def draw_frame(self):
+        """Draw now, for the paint events of the system. A pending frame is still drawn"""
+        start = self.clock()
+        self.last_frame = start
+        self.draw()
+        self.frame_times.append(self.clock() - start)
+        self.frame_starts.append(start)
+        self.frames += 1
+
+    def get_stats(self):
+        """Frame rate over the last frames, and their mean and longest durations in milliseconds"""
+        stats = {'fps': 0., 'frame_time': 0., 'max_frame_time': 0., 'frames': self.frames, 'requests': self.requests}
+        if self.frame_times:
+            stats['frame_time'] = 1000 * sum(self.frame_times) / len(self.frame_times)
+            stats['max_frame_time'] = 1000 * max(self.frame_times)
+        if len(self.frame_starts) > 1 and self.frame_starts[-1] > self.frame_starts[0]:
+            stats['fps'] = (len(self.frame_starts) - 1) / (self.frame_starts[-1] - self.frame_starts[0])
+        return stats
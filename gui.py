@@ -1,6 +1,8 @@
 import wx
 from myglcanvas import myGLCanvas
 from renderer import Renderer
+from core_renderer import CoreRenderer
+from frame_scheduler import FrameScheduler
 
 
 class MouseEventHandler:
@@ -34,10 +36,14 @@ class EventHandler:
             self.frame.manager.set_data_path(dlg.GetPath())
         dlg.Destroy()
 
+    def on_pressed_rescan_button(self, event):
+        # Scanning a large data folder takes a while, the window stays responsive
+        self.frame.manager.rescan_in_background()
+
     def on_tree_selected_file(self, event):
         filename = self.frame.get_selected_file()
-        self.frame.manager.set_file_path(filename)
-        self.frame.manager.load_main_file()
+        # Loaded in background, selecting an other file cancels this one
+        self.frame.manager.load_in_background(filename)
         print(filename)
 
     def on_pressed_load_button(self, event):
@@ -45,15 +51,16 @@ class EventHandler:
         dlg = wx.FileDialog(self.frame, title,
                             style=wx.DD_DEFAULT_STYLE)
         if dlg.ShowModal() == wx.ID_OK:
-            self.frame.manager.set_file_path(dlg.GetPath())
-            self.frame.manager.load_file()
+            self.frame.manager.load_in_background(dlg.GetPath())
         dlg.Destroy()
 
 
 class MainWindow(wx.Frame):
-    def __init__(self, manager, *args, **kwargs):
+    def __init__(self, manager, *args, core_profile=False, **kwargs):
         super(MainWindow, self).__init__(*args, **kwargs)
         self.manager = manager
+        # Render with the core profile renderer instead of the fixed-function one
+        self.core_profile = core_profile
 
         #Splitted window
         self.splitter_window = wx.SplitterWindow(self, wx.ID_ANY, style=wx.SP_3D)
@@ -70,11 +77,28 @@ class MainWindow(wx.Frame):
         #self.SetSizer(self.sizer)
         self.event_handler = EventHandler(self)
         self.init_frame()
+        # Loading progress, and statistics of the last frame
+        self.CreateStatusBar(2)
         self.Show()
 
+    # The manager calls these from the loading threads, the GL panel is only used from the GUI thread
+    def on_main_loaded(self):
+        # Drawn while its dependencies load, they appear as they arrive
+        wx.CallAfter(self.gl_panel.on_main_loaded, self.manager.main_rdm_model, self.manager.main_asset)
+
     def on_file_load(self):
-        self.gl_panel.Refresh()
-        self.gl_panel.renderer.initialize()
+        wx.CallAfter(self.gl_panel.request_frame)
+
+    def on_texture_update(self):
+        # Called from the texture streaming thread
+        wx.CallAfter(self.gl_panel.request_frame)
+
+    def on_data_deleted(self):
+        wx.CallAfter(self.gl_panel.on_data_deleted)
+
+    def on_load_progress(self, progress):
+        wx.CallAfter(self.SetStatusText, str(progress))
+        wx.CallAfter(self.gl_panel.request_frame)
 
     def get_selected_file(self):
         return self.tree_panel.get_selected_file()
@@ -83,8 +107,9 @@ class MainWindow(wx.Frame):
         menu_bar = wx.MenuBar()
         file_button = wx.Menu()
         about_button = wx.Menu()
-        load_item = file_button.Append(0, 'Load file', 'Status bar message')
-        folder_item = file_button.Append(0, 'Select Data folder', 'Status bar message')
+        load_item = file_button.Append(wx.ID_ANY, 'Load file', 'Status bar message')
+        folder_item = file_button.Append(wx.ID_ANY, 'Select Data folder', 'Status bar message')
+        rescan_item = file_button.Append(wx.ID_ANY, 'Rescan data folder', 'Status bar message')
         exit_item = file_button.Append(wx.ID_EXIT, 'Exit', 'Status bar message')
 
         menu_bar.Append(file_button, '&File')
@@ -94,6 +119,7 @@ class MainWindow(wx.Frame):
         self.Bind(wx.EVT_MENU, self.event_handler.on_pressed_exit_button, exit_item)
         self.Bind(wx.EVT_MENU, self.event_handler.on_pressed_load_button, load_item)
         self.Bind(wx.EVT_MENU, self.event_handler.on_pressed_folder_button, folder_item)
+        self.Bind(wx.EVT_MENU, self.event_handler.on_pressed_rescan_button, rescan_item)
         self.Bind(wx.EVT_DIRCTRL_FILEACTIVATED, self.event_handler.on_tree_selected_file, self.tree_panel.tree)
 
 
@@ -116,14 +142,25 @@ class GLPanel(wx.Panel):
     # Usefull links: https://wiki.wxpython.org/GLCanvas
     def __init__(self, *arg, **kwargs):
         super().__init__(*arg, **kwargs)
-        self.canvas = myGLCanvas(self, id=wx.ID_ANY, size=(500, 500))
+        core_profile = self.TopLevelParent.core_profile
+        self.canvas = myGLCanvas(self, id=wx.ID_ANY, size=(500, 500), core_profile=core_profile)
         self.GLinitialized = False
         self.angle_x = 0
         self.angle_y = 0
         self.trans_x = 0
         self.trans_y = 0
         self.zoom = 0
-        self.renderer = Renderer(self.TopLevelParent.manager)
+        # The camera is set again before the next frame
+        self.view_changed = True
+        # Input and loading events request frames, merged and drawn at most max_fps times per second
+        self.scheduler = FrameScheduler(self.draw_frame, GLPanel.call_later)
+        if core_profile:
+            self.renderer = CoreRenderer(self.TopLevelParent.manager, self.canvas.camera)
+        else:
+            self.renderer = Renderer(self.TopLevelParent.manager, self.canvas.camera)
+        # The loaded file drawn, set once it is loaded
+        self.model = None
+        self.asset = None
 
 
 
@@ -143,6 +180,33 @@ class GLPanel(wx.Panel):
         self.Layout()
 
 
+    def on_main_loaded(self, model, asset):
+        self.model = model
+        self.asset = asset
+        self.canvas.SetCurrent(self.canvas.gl_context)
+        self.renderer.initialize()
+        self.request_frame()
+
+    def on_data_deleted(self):
+        self.model = None
+        self.asset = None
+        self.renderer.release_buffers()
+        self.request_frame()
+
+    @staticmethod
+    def call_later(delay, function):
+        if delay > 0:
+            wx.CallLater(max(1, int(delay * 1000)), function)
+        else:
+            wx.CallAfter(function)
+
+    def request_frame(self):
+        self.scheduler.request_frame()
+
+    def draw_frame(self):
+        self.PrepareGL()
+        self.OnDraw()
+
     def OnDrag(self, dx, dy, strat=False):
         if strat:
             self.trans_x += -dx*0.01
@@ -150,11 +214,13 @@ class GLPanel(wx.Panel):
         else:
             self.angle_x += dx
             self.angle_y += dy
-        self.Refresh(False)
+        self.view_changed = True
+        self.request_frame()
 
     def OnScroll(self, rotation):
         self.zoom += rotation * 0.01
-        self.Refresh(False)
+        self.view_changed = True
+        self.request_frame()
 
     def processEraseBackgroundEvent(self, event):
         pass  # Do nothing, to avoid flashing on MSWin
@@ -162,13 +228,14 @@ class GLPanel(wx.Panel):
     def processSizeEvent(self, event):
         size = self.canvas.GetClientSize()
         self.OnReshape(size.width, size.height)
-        self.canvas.Refresh(False)
+        self.request_frame()
         event.Skip()
 
     def processPaintEvent(self, event):
         """Process the drawing event."""
-        self.PrepareGL()
-        self.OnDraw()
+        # The window was exposed, it is drawn now
+        wx.PaintDC(self.canvas)
+        self.scheduler.draw_frame()
         event.Skip()
 
     def PrepareGL(self):
@@ -178,23 +245,29 @@ class GLPanel(wx.Panel):
             self.GLinitialized = True
             size = self.canvas.GetClientSize()
 
-        self.canvas.set_view(self.angle_x, self.angle_y, self.zoom, self.trans_x, self.trans_y)
+        if self.view_changed:
+            self.view_changed = False
+            self.canvas.set_view(self.angle_x, self.angle_y, self.zoom, self.trans_x, self.trans_y)
 
 
 
     def OnReshape(self, width, height):
         """Reshape the OpenGL viewport based on the dimensions of the window."""
-        if self.GLinitialized:
-            self.canvas.set_view(self.angle_x, self.angle_y, self.zoom, self.trans_x, self.trans_y)
+        self.view_changed = True
 
     def OnDraw(self, *args, **kwargs):
         """Draw the window."""
 
-        model = self.TopLevelParent.manager.main_rdm_model
-        asset = self.TopLevelParent.manager.main_asset
-
-        self.renderer.render(model, asset)
+        self.renderer.render(self.model, self.asset)
         self.canvas.SwapBuffers()
+        stats = dict(self.renderer.frame_stats, **self.scheduler.get_stats())
+        self.TopLevelParent.SetStatusText("{draws} draws, {triangles} triangles, {state_changes} state changes "
+                                          "({state_changes_unsorted} unsorted), {nodes_visible} visible / "
+                                          "{nodes_culled} culled nodes, {fps:.0f} fps, {frame_time:.1f} ms "
+                                          "per frame".format(**stats), 1)
+        if self.renderer.pending_uploads:
+            # Upload the rest in the next frames
+            self.request_frame()
 
 
 
@@ -0,0 +1,161 @@
+"""Render a cfg or rdm file to a PNG image without a window, in an offscreen context of Mesa's software rasterizer:
+    python headless.py file.cfg image.png --data D:\\data_Anno1800 --size 800 600 --angle 30 20
+The GL platform is chosen before OpenGL is imported, so nothing from OpenGL is imported at the top of this module."""
+import argparse
+import ctypes
+import os
+import sys
+import numpy as np
+from PIL import Image
+
+PLATFORMS = ('egl', 'osmesa')
+# Frames drawn at most while meshes and textures are uploaded
+MAX_FRAMES = 100
+
+
+def set_platform(platform):
+    """Select the PyOpenGL platform, before OpenGL is imported"""
+    os.environ['PYOPENGL_PLATFORM'] = platform
+    if platform == 'egl':
+        # Mesa's EGL without a display server
+        os.environ.setdefault('EGL_PLATFORM', 'surfaceless')
+
+
+def create_egl_context(width, height, core_profile=False):
+    from OpenGL import EGL
+    display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+    if not EGL.eglInitialize(display, None, None):
+        raise RuntimeError("can't initialize EGL")
+    attributes = (EGL.EGLint * 13)(EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT, EGL.EGL_RED_SIZE, 8,
+                                   EGL.EGL_GREEN_SIZE, 8, EGL.EGL_BLUE_SIZE, 8, EGL.EGL_DEPTH_SIZE, 24,
+                                   EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT, EGL.EGL_NONE)
+    config = EGL.EGLConfig()
+    n_configs = EGL.EGLint()
+    if not EGL.eglChooseConfig(display, attributes, ctypes.pointer(config), 1, ctypes.pointer(n_configs)) or \
+            not n_configs.value:
+        raise RuntimeError("no EGL config with a depth buffer")
+    surface = EGL.eglCreatePbufferSurface(display, config, (EGL.EGLint * 5)(EGL.EGL_WIDTH, width, EGL.EGL_HEIGHT,
+                                                                            height, EGL.EGL_NONE))
+    EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+    context_attributes = None
+    if core_profile:
+        context_attributes = (EGL.EGLint * 7)(EGL.EGL_CONTEXT_MAJOR_VERSION, 3, EGL.EGL_CONTEXT_MINOR_VERSION, 3,
+                                              EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK,
+                                              EGL.EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT, EGL.EGL_NONE)
+    context = EGL.eglCreateContext(display, config, EGL.EGL_NO_CONTEXT, context_attributes)
+    if not context or not EGL.eglMakeCurrent(display, surface, surface, context):
+        raise RuntimeError("can't create the EGL context")
+    return display, surface, context
+
+
+def create_osmesa_context(width, height, core_profile=False):
+    from OpenGL import osmesa, arrays
+    from OpenGL.GL import GL_UNSIGNED_BYTE
+    if core_profile:
+        attributes = arrays.GLintArray.asArray([osmesa.OSMESA_FORMAT, osmesa.OSMESA_RGBA, osmesa.OSMESA_DEPTH_BITS, 24,
+                                                osmesa.OSMESA_PROFILE, osmesa.OSMESA_CORE_PROFILE,
+                                                osmesa.OSMESA_CONTEXT_MAJOR_VERSION, 3,
+                                                osmesa.OSMESA_CONTEXT_MINOR_VERSION, 3, 0])
+        context = osmesa.OSMesaCreateContextAttribs(attributes, None)
+    else:
+        context = osmesa.OSMesaCreateContextExt(osmesa.OSMESA_RGBA, 24, 0, 0, None)
+    # OSMesa draws in this buffer, it is kept with the context
+    buffer = arrays.GLubyteArray.zeros((height, width, 4))
+    if not context or not osmesa.OSMesaMakeCurrent(context, buffer, GL_UNSIGNED_BYTE, width, height):
+        raise RuntimeError("can't create the OSMesa context")
+    return context, buffer
+
+
+def create_context(width, height, platform='egl', core_profile=False):
+    if platform == 'osmesa':
+        return create_osmesa_context(width, height, core_profile)
+    return create_egl_context(width, height, core_profile)
+
+
+def read_image(width, height):
+    from OpenGL.GL import glFinish, glPixelStorei, glReadPixels, GL_PACK_ALIGNMENT, GL_RGBA, GL_UNSIGNED_BYTE
+    glFinish()
+    glPixelStorei(GL_PACK_ALIGNMENT, 1)
+    data = glReadPixels(0, 0, width, height, GL_RGBA, GL_UNSIGNED_BYTE)
+    pixels = np.frombuffer(data, dtype=np.uint8).reshape(height, width, 4)
+    # GL rows start at the bottom
+    return Image.fromarray(np.ascontiguousarray(pixels[::-1, :, 0:3]), 'RGB')
+
+
+def render_file(filename, width=800, height=600, angle_x=0, angle_y=0, zoom=0, trans_x=0, trans_y=0, fov=20,
+                data_path=None, core_profile=False):
+    """Load a cfg or rdm file with its dependencies and render it in the current context, returns a PIL image.
+    Raises RuntimeError if the file can't be loaded"""
+    from OpenGL.GL import glViewport, glMatrixMode, glLoadMatrixf, GL_PROJECTION, GL_MODELVIEW
+    from asset_manager import AssetManager
+    from camera import Camera
+    from renderer import Renderer
+    from core_renderer import CoreRenderer
+
+    manager = AssetManager()
+    if data_path is not None:
+        manager.set_data_path(data_path)
+    manager.set_file_path(filename)
+    manager.load_main_file()
+    if manager.main_asset is None and manager.main_rdm_model is None:
+        manager.close()
+        raise RuntimeError("can't load {}".format(filename))
+
+    camera = Camera()
+    camera.set_view(width, height, angle_x, angle_y, zoom, trans_x, trans_y, fov=fov)
+    renderer = CoreRenderer(manager, camera) if core_profile else Renderer(manager, camera)
+    # Nothing is shown before everything is uploaded
+    renderer.upload_budget = float('inf')
+    glViewport(0, 0, width, height)
+    try:
+        for _ in range(MAX_FRAMES):
+            # The first frame only initializes the renderer
+            drawing = renderer.initialized
+            if not core_profile:
+                glMatrixMode(GL_PROJECTION)
+                glLoadMatrixf(camera.gl_projection())
+                glMatrixMode(GL_MODELVIEW)
+                glLoadMatrixf(camera.gl_view())
+            version = manager.meshes.version
+            renderer.render(manager.main_rdm_model, manager.main_asset)
+            # Levels of detail are loaded in background once the renderer requests them
+            manager.wait_requested_meshes()
+            if drawing and not renderer.pending_uploads and version == manager.meshes.version:
+                break
+        return read_image(width, height)
+    finally:
+        manager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render a cfg or rdm file to a PNG image without a window')
+    parser.add_argument('file', help='cfg or rdm file')
+    parser.add_argument('output', help='PNG image written')
+    parser.add_argument('--data', help='data folder of the game files')
+    parser.add_argument('--size', type=int, nargs=2, default=(800, 600), metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--angle', type=float, nargs=2, default=(0, 0), metavar=('X', 'Y'),
+                        help='rotations of the camera in degrees')
+    parser.add_argument('--zoom', type=float, default=0)
+    parser.add_argument('--translation', type=float, nargs=2, default=(0, 0), metavar=('X', 'Y'))
+    parser.add_argument('--fov', type=float, default=20)
+    parser.add_argument('--platform', choices=PLATFORMS, default=os.environ.get('PYOPENGL_PLATFORM', 'egl'))
+    parser.add_argument('--core-profile', action='store_true', help='render with the core profile renderer')
+    args = parser.parse_args()
+
+    set_platform(args.platform)
+    width, height = args.size
+    context = create_context(width, height, args.platform, args.core_profile)
+    try:
+        image = render_file(args.file, width, height, args.angle[0], args.angle[1], args.zoom, args.translation[0],
+                            args.translation[1], args.fov, args.data, args.core_profile)
+    except RuntimeError as e:
+        # No image, and a non zero exit code for scripts
+        print(e)
+        sys.exit(1)
+    image.save(args.output)
+    print("Image written:", args.output)
+    return context
+
+
+if __name__ == '__main__':
+    main()
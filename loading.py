@@ -0,0 +1,68 @@
+import threading
+import time
+
+
+class LoadCancelled(Exception):
+    """Raised in the loading thread when an other file is selected"""
+
+
+class LoadProgress:
+    """Progress of the loading of a file, shared by the loading threads.
+    files_total counts the files found so far, it grows while the cfg files are parsed."""
+
+    def __init__(self, callback=None, interval=0.1):
+        # Called with the progress from the loading threads, at most every interval seconds
+        self.callback = callback
+        self.interval = interval
+        self.files_done = 0
+        self.files_total = 0
+        self.bytes_decoded = 0
+        self.cancelled = False
+        self.finished = False
+        self.start_time = time.monotonic()
+        self.last_report = 0.
+        self.lock = threading.Lock()
+
+    def add_files(self, n=1):
+        with self.lock:
+            self.files_total += n
+        self.report()
+
+    def file_done(self, value=None):
+        """Count a file as loaded, with the size of its decoded data (mesh or texture)"""
+        with self.lock:
+            self.files_done += 1
+            self.bytes_decoded += getattr(value, 'nbytes', 0)
+        self.report()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise LoadCancelled()
+
+    def finish(self):
+        self.finished = True
+        self.report(force=True)
+
+    def elapsed(self):
+        return time.monotonic() - self.start_time
+
+    def report(self, force=False):
+        if self.callback is None:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if not force and now - self.last_report < self.interval:
+                return
+            self.last_report = now
+        self.callback(self)
+
+    def __str__(self):
+        text = "{}/{} files, {:.1f} MB".format(self.files_done, self.files_total, self.bytes_decoded / 2 ** 20)
+        if self.cancelled:
+            return "Cancelled: " + text
+        if self.finished:
+            return "Loaded: {} in {:.1f} s".format(text, self.elapsed())
+        return "Loading: " + text
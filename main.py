@@ -1,10 +1,24 @@
+import argparse
 import wx
 from gui import MainWindow
 from asset_manager import AssetManager
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Anno1800 Asset Viewer')
+    parser.add_argument('--core-profile', action='store_true',
+                        help='render with an OpenGL 3.3 core profile context and shaders')
+    parser.add_argument('--texture-processes', type=int, default=0, metavar='N',
+                        help='decode the textures to RGBA in N processes, instead of uploading them compressed')
+    parser.add_argument('--stream-textures', action='store_true',
+                        help='show the lowest resolution level of the textures first, and load the others in background')
+    args = parser.parse_args()
     app = wx.App()
     model = AssetManager()
-    root = MainWindow(model, None, title='Anno1800 Asset Viewer', size=(1000, 700))
+    model.stream_textures = args.stream_textures
+    if args.texture_processes > 0:
+        model.texture_processes = args.texture_processes
+        model.compressed_textures = False
+    root = MainWindow(model, None, title='Anno1800 Asset Viewer', size=(1000, 700), core_profile=args.core_profile)
     model.window = root
     app.MainLoop()
+    model.close()
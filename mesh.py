@@ -1,75 +1,182 @@
-import math
-from anno_rdm_converter import rdm as rdm_conv
+import numpy as np
 
+# Vertex formats found in rdm files, used when the format is unknown. A size shared by several formats needs the
+# format to be given: P3f_N3f_G3f_T2f_T1f_T1f_T1f and the skinned P4h_N4b_G4b_B4b_T2h_I4b_I4b_I4b_I4b_W4b_W4b_W4b_W4b
+# are both 56 bytes.
+VERTEX_FORMATS = [
+    'P4h_N4b_G4b_B4b_T2h',
+    'P4h_N4b_G4b_B4b_T2h_I4b',
+    'P4h_N4b_G4b_B4b_T2h_C4b_C4b',
+    'P3f_N3f_G3f_T2f_T1f_T1f_T1f',
+    'P4h_N4b_G4b_B4b_T2h_I4b_I4b_I4b_I4b_W4b_W4b_W4b_W4b',
+    'P4h_N4b_T2h_I4b',
+    'P4h_T2h_C4c',
+]
+# Attribute names of the vertex format components
+COMPONENT_NAMES = {'P': 'pos', 'N': 'norm', 'G': 'tangent', 'B': 'bitangent', 'T': 'tex', 'I': 'index', 'W': 'weight',
+                   'C': 'color'}
+# Numpy types of the vertex format components (little endian)
+COMPONENT_TYPES = {'h': '<f2', 'f': '<f4', 'b': 'u1', 'c': 'u1'}
+# Numpy types of the indices, by size in bytes
+INDEX_TYPES = {2: '<u2', 4: '<u4'}
 
-def convert_normal(norm):
-    n_1 = [n * 1. / 255 * 2 - 1 for n in norm]
-    length = math.sqrt(sum([n ** 2 for n in n_1]))
-    return [n / length for n in n_1]
+
+def vertex_dtype(vertex_format):
+    """Build a structured numpy type from a vertex format name like P4h_N4b_G4b_B4b_T2h"""
+    fields = []
+    names = []
+    for component in vertex_format.split('_'):
+        name = COMPONENT_NAMES[component[0]]
+        # Repeated components (I4b_I4b...) are numbered
+        if name in names:
+            name += str(names.count(name))
+        names.append(COMPONENT_NAMES[component[0]])
+        fields.append((name, COMPONENT_TYPES[component[-1]], (int(component[1:-1]),)))
+    return np.dtype(fields)
+
+
+def guess_vertex_format(vertex_size):
+    formats = [f for f in VERTEX_FORMATS if vertex_dtype(f).itemsize == vertex_size]
+    if not formats:
+        raise ValueError("Unknown vertex format of size {}".format(vertex_size))
+    if len(formats) > 1:
+        raise ValueError("Vertex format of size {} is ambiguous ({}), it must be given".format(
+            vertex_size, ', '.join(formats)))
+    return formats[0]
+
+
+def block_buffer(block):
+    """Return a rdm block as one contiguous buffer and the size of its elements (None if unknown)"""
+    if isinstance(block, (bytes, bytearray, memoryview)):
+        return block, None
+    if len(block) == 0:
+        return b'', None
+    return b''.join(block), len(block[0])
+
+
+def resolve_vertex_format(vertex_size, vertex_format=None):
+    """Return the vertex format used to decode vertices of vertex_size bytes, given the expected format"""
+    if vertex_format is None or (vertex_size and vertex_dtype(vertex_format).itemsize != vertex_size):
+        if vertex_size is None:
+            raise ValueError("Vertex format needed to decode a contiguous vertex block")
+        vertex_format = guess_vertex_format(vertex_size)
+    return vertex_format
+
+
+def decode_vertices(block, vertex_format=None):
+    """View the vertices of a rdm block as a structured array"""
+    buffer, vertex_size = block_buffer(block)
+    return np.frombuffer(buffer, dtype=vertex_dtype(resolve_vertex_format(vertex_size, vertex_format)))
+
+
+def decode_indices(block, index_size=None):
+    buffer, size = block_buffer(block)
+    return np.frombuffer(buffer, dtype=INDEX_TYPES[size or index_size or 2])
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, 3)
+    length = np.sqrt(np.sum(vectors ** 2, axis=1, keepdims=True))
+    length[length == 0] = 1
+    return vectors / length
+
+
+def convert_normals(norm):
+    """Convert packed normals (0-255 per component) to unit vectors"""
+    return normalize(np.asarray(norm, dtype=np.float32).reshape(-1, 3) * (2. / 255) - 1)
+
+
+def interleave(positions, normals, uvs):
+    """Build the interleaved vertex array: position (3), normal (3), uv (2)"""
+    positions = np.asarray(positions, dtype=np.float32).reshape(-1, 3)
+    vertices = np.empty((len(positions), 8), dtype=np.float32)
+    vertices[:, 0:3] = positions
+    vertices[:, 3:6] = np.asarray(normals, dtype=np.float32).reshape(-1, 3)
+    vertices[:, 6:8] = np.asarray(uvs, dtype=np.float32).reshape(-1, 2)
+    return vertices
 
 
 class Mesh:
-    """Contain a list of trigs """
+    """Contain the interleaved vertices and the trigs indices as numpy arrays"""
 
-    def __init__(self, vertices, indices, groups=None):
-        self.vertices = vertices
+    def __init__(self, vertices, indices, groups=None, vertex_format=None):
+        self.vertices = np.ascontiguousarray(vertices, dtype=np.float32).reshape(-1, 8)
+        self.indices = np.ascontiguousarray(indices, dtype=np.uint32).reshape(-1)
         self.groups = groups
-        self.indices = indices
-        self.ordered_vertices = []
+        # Vertex format the mesh was decoded from
+        self.vertex_format = vertex_format
+
+    @property
+    def nbytes(self):
+        return self.vertices.nbytes + self.indices.nbytes
+
+    @property
+    def positions(self):
+        return self.vertices[:, 0:3]
 
-        #TODO, this should be done by the renderer
-        for i in self.indices:
-            vertex = self.vertices[i]
-            self.ordered_vertices += vertex.pos[0:3]
-            self.ordered_vertices += convert_normal(vertex.norm[0:3])
-            self.ordered_vertices += vertex.tex[0:2]
+    @property
+    def normals(self):
+        return self.vertices[:, 3:6]
+
+    @property
+    def uvs(self):
+        return self.vertices[:, 6:8]
 
     @staticmethod
-    def from_rdm(data):
+    def from_rdm(data, vertex_format=None):
         meshes = data.main_record.get('mesh', [])
 
         def parse_mesh(mesh):
-            indices = [rdm_conv.VertexIndex.decode(t).index for t in mesh['faces']]
-            vertices = [Vertex.from_rdm(v) for v in mesh['vertices']]
+            # Copied, the rdm data may be a mapped file
+            indices = decode_indices(mesh['faces']).astype(np.uint32)
+            buffer, vertex_size = block_buffer(mesh['vertices'])
+            mesh_format = resolve_vertex_format(vertex_size, vertex_format)
+            vertices = np.frombuffer(buffer, dtype=vertex_dtype(mesh_format))
+            n_vertices = len(vertices)
+            fields = vertices.dtype.names
+            positions = vertices['pos'][:, 0:3]
+            if 'norm' in fields and vertices.dtype['norm'].base.kind == 'f':
+                normals = normalize(vertices['norm'][:, 0:3])
+            elif 'norm' in fields:
+                normals = convert_normals(vertices['norm'][:, 0:3])
+            else:
+                normals = convert_normals(np.tile((128, 255, 128), (n_vertices, 1)))
+            if 'tex' in fields:
+                uvs = vertices['tex'][:, 0:2]
+            else:
+                uvs = np.zeros((n_vertices, 2))
+            # Groups are ranges of the index buffer
             groups = [{'offset': g.offset, 'size': g.size, 'n': g.n} for g in mesh['groups'].values()]
-            return Mesh(vertices, indices, groups=groups)
+            return Mesh(interleave(positions, normals, uvs), indices, groups=groups, vertex_format=mesh_format)
 
         return Mesh.merge_meshes([parse_mesh(m) for m in meshes])
 
     @staticmethod
     def merge_meshes(mesh_list):
-        vertices = []
-        indices = []
+        if len(mesh_list) == 1:
+            return mesh_list[0]
+        # Start of each mesh in the merged arrays
+        vertex_offsets = np.cumsum([0] + [len(m.vertices) for m in mesh_list])
+        index_offsets = np.cumsum([0] + [len(m.indices) for m in mesh_list])
+        vertices = np.empty((vertex_offsets[-1], 8), dtype=np.float32)
+        indices = np.empty(index_offsets[-1], dtype=np.uint32)
         groups = []
-        for mesh in mesh_list:
-            groups += [{'offset': g['offset'] + len(indices), 'size': g['size'], 'n': g['n']} for g in mesh.groups]
-            indices += [i + len(vertices) for i in mesh.indices]
-            vertices += mesh.vertices
-        return Mesh(vertices, indices, groups=groups)
-
+        for mesh, v_start, v_end, i_start, i_end in zip(mesh_list, vertex_offsets, vertex_offsets[1:],
+                                                        index_offsets, index_offsets[1:]):
+            vertices[v_start:v_end] = mesh.vertices
+            np.add(mesh.indices, v_start, out=indices[i_start:i_end], casting='unsafe')
+            groups += [{'offset': g['offset'] + int(i_start), 'size': g['size'], 'n': g['n']} for g in mesh.groups]
+        vertex_format = mesh_list[0].vertex_format if mesh_list else None
+        return Mesh(vertices, indices, groups=groups, vertex_format=vertex_format)
 
     @staticmethod
     def gen_square(size_x, size_y):
         n = (128, 255, 128)
-        v1 = Vertex(pos=(0, 0, 0), norm=n, tex=(0, 1))
-        v2 = Vertex(pos=(size_x, 0, 0), norm=n, tex=(1, 1))
-        v3 = Vertex(pos=(size_x, 0, size_y), norm=n, tex=(1, 0))
-        v4 = Vertex(pos=(0, 0, size_y), norm=n, tex=(0, 0))
         mesh = Mesh(
-            vertices=[v1, v2, v3, v4],
+            vertices=interleave(
+                positions=[(0, 0, 0), (size_x, 0, 0), (size_x, 0, size_y), (0, 0, size_y)],
+                normals=convert_normals([n] * 4),
+                uvs=[(0, 1), (1, 1), (1, 0), (0, 0)]),
             indices=[2, 1, 0, 3, 2, 0],
             groups=[{'n': 0, 'offset': 0, 'size': 6}])
         return mesh
-
-
-class Vertex:
-    def __init__(self, **kwarg):
-        # TODO: set default value to None
-        self.pos = kwarg.get('pos', (0, 0, 0))
-        self.norm = kwarg.get('norm', (128, 255, 128))
-        self.tex = kwarg.get('tex', (0, 0))
-
-    @staticmethod
-    def from_rdm(data):
-        rdm_vertex = rdm_conv.Vertex.decode(data)
-        return Vertex(pos=rdm_vertex['pos'], norm=rdm_vertex['norm'], tex=rdm_vertex['tex'])
@@ -0,0 +1,98 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from mesh import Mesh, vertex_dtype
+
+# Folder created in the data folder for the viewer caches
+CACHE_FOLDER = '.viewer_cache'
+# Increment when the decoded mesh layout changes, to ignore older cache entries
+CACHE_VERSION = 1
+
+
+def normalize_filename(filename):
+    return filename.replace('\\', '/').lower()
+
+
+class MeshDiskCache:
+    """Decoded meshes stored as .npy files, one folder per mesh, read in memory without decoding.
+    Entries are keyed by the relative path, size and modification time of the rdm file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    @staticmethod
+    def get_key(filename, file_path):
+        stat = os.stat(file_path)
+        key = '{}|{}|{}|{}'.format(CACHE_VERSION, normalize_filename(filename), stat.st_size, stat.st_mtime_ns)
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def load(self, key, vertex_format=None):
+        """Return the cached mesh, or None if it isn't cached or was decoded with an other vertex format"""
+        folder = os.path.join(self.path, key)
+        try:
+            with open(os.path.join(folder, 'info.json'), 'r') as f:
+                info = json.load(f)
+            cached_format = info['vertex_format']
+            if vertex_format and cached_format and vertex_format != cached_format and \
+                    vertex_dtype(vertex_format).itemsize == vertex_dtype(cached_format).itemsize:
+                return None
+            # Not memory-mapped: a map keeps a file descriptor open while the mesh is in the memory cache
+            vertices = np.load(os.path.join(folder, 'vertices.npy'))
+            indices = np.load(os.path.join(folder, 'indices.npy'))
+            groups = np.load(os.path.join(folder, 'groups.npy'))
+        except (OSError, ValueError, KeyError):
+            return None
+        groups = [{'offset': int(offset), 'size': int(size), 'n': int(n)} for offset, size, n in groups]
+        return Mesh(vertices, indices, groups=groups, vertex_format=cached_format)
+
+    def save(self, key, mesh, filename=None):
+        os.makedirs(self.path, exist_ok=True)
+        folder = os.path.join(self.path, key)
+        # Written in a temporary folder first, so an other process never sees a partial entry
+        temp_folder = tempfile.mkdtemp(dir=self.path)
+        try:
+            groups = np.array([(g['offset'], g['size'], g['n']) for g in mesh.groups], dtype=np.int64).reshape(-1, 3)
+            np.save(os.path.join(temp_folder, 'vertices.npy'), mesh.vertices)
+            np.save(os.path.join(temp_folder, 'indices.npy'), mesh.indices)
+            np.save(os.path.join(temp_folder, 'groups.npy'), groups)
+            with open(os.path.join(temp_folder, 'info.json'), 'w') as f:
+                json.dump({'filename': filename, 'vertex_format': mesh.vertex_format}, f)
+            if os.path.isdir(folder):
+                shutil.rmtree(folder, ignore_errors=True)
+            os.replace(temp_folder, folder)
+        except OSError:
+            shutil.rmtree(temp_folder, ignore_errors=True)
+            raise
+
+
+def warm_cache(data_path):
+    """Decode every rdm file of the data folder into the mesh cache"""
+    from asset_manager import AssetManager
+    manager = AssetManager()
+    manager.set_data_path(os.path.join(data_path, ''))
+    n_files = 0
+    for root, dirs, files in os.walk(data_path):
+        if CACHE_FOLDER in dirs:
+            dirs.remove(CACHE_FOLDER)
+        for name in files:
+            if not name.endswith('.rdm'):
+                continue
+            filename = os.path.relpath(os.path.join(root, name), data_path)
+            try:
+                manager.read_rdm(filename)
+            except Exception as e:
+                print("can't decode ", filename, e)
+            else:
+                n_files += 1
+    print(n_files, "meshes in cache")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fill the mesh cache of a data folder")
+    parser.add_argument('data_path', help="data folder containing the extracted rdm files")
+    args = parser.parse_args()
+    warm_cache(args.data_path)
@@ -1,21 +1,106 @@
 from OpenGL.GL import *
+from OpenGL.GL.EXT.texture_compression_s3tc import *
 from OpenGL.arrays import vbo
+from OpenGL.GL import shaders
+from OpenGL import extensions
 from mesh import Mesh
-from asset import Asset, TransformerOrientation
+from asset import Asset
+from camera import Camera
+from scene import Scene, count_state_changes, select_lod
+from shaders import INSTANCED_VERTEX_SHADER, INSTANCED_FRAGMENT_SHADER
 import numpy as np
 import math
+import time
+
+# Time in seconds spent uploading meshes and textures in a frame, the others are uploaded in the next frames
+UPLOAD_BUDGET = 0.008
+
+
+class MeshBuffer:
+    """GPU copy of a mesh, uploaded once and reused across frames"""
+
+    def __init__(self, mesh):
+        self.groups = mesh.groups
+        self.vbo = vbo.VBO(mesh.vertices)
+        self.ibo = vbo.VBO(mesh.indices, target=GL_ELEMENT_ARRAY_BUFFER)
+        # Vertex array object of the core profile renderer
+        self.vao = None
+
+    def upload(self):
+        self.vbo.bind()
+        self.vbo.unbind()
+        self.ibo.bind()
+        self.ibo.unbind()
+
+    def delete(self):
+        self.vbo.delete()
+        self.ibo.delete()
+        if self.vao is not None:
+            glDeleteVertexArrays(1, [self.vao])
+            self.vao = None
 
 
 class Renderer:
-    def __init__(self, manager):
+    def __init__(self, manager, camera=None):
         self.asset_manager = manager
+        # Projection and view matrices, set by the canvas
+        self.camera = camera if camera is not None else Camera()
         self.textures = {}
-        self.shaderProgram = None
+        # The DDSImage uploaded for each texture, a texture is uploaded again when the manager replaces its image
+        self.uploaded_textures = {}
+        # Version of the manager texture cache when the evicted textures were last deleted
+        self.textures_version = None
+        # GPU buffers of the meshes. keys are the same as AssetManager.meshes
+        self.buffers = {}
+        # buffers waiting to be deleted on the GL thread
+        self.released_buffers = []
+        # GL internal formats of the block compressed texture formats supported by the driver
+        self.compressed_formats = {}
+        # Time spent uploading in the current frame, and whether some uploads were left for the next frames
+        self.upload_budget = UPLOAD_BUDGET
+        self.upload_time = 0.
+        self.pending_uploads = False
+        # Draw list of the asset drawn
+        self.scene = Scene(manager)
+        # Draw the props using the same mesh with one instanced call, if the driver can
+        self.use_instancing = True
+        self.instance_program = None
+        self.instance_location = None
+        # Bound instead of no texture in the instanced shader, which would sample black
+        self.white_texture = None
+        # Sort the draws of a frame by shader, texture and buffers
+        self.sort_draws = True
+        # Skip the nodes of the asset outside the view
+        self.culling = True
+        # Draw the models with _lodN.rdm variants at the level of detail of their size on screen
+        self.use_lods = True
+        # Draws and state changes of the last frame, with the state changes there would be without sorting,
+        # and the nodes of the asset inside and outside the view
+        self.frame_stats = Renderer.new_frame_stats()
         self.initialized = False
 
     def initialize(self):
-        self.textures = {}
+        # Textures still in the manager cache are kept when an other file is loaded
+        self.delete_evicted_textures()
+        self.init_state()
+        self.compressed_formats = Renderer.get_compressed_formats()
+        self.init_shaders()
+        self.delete_released_buffers()
+        self.initialized = True
 
+    @staticmethod
+    def new_frame_stats():
+        return {'draws': 0, 'state_changes': 0, 'state_changes_unsorted': 0, 'nodes_visible': 0, 'nodes_culled': 0,
+                'triangles': 0}
+
+    def begin_frame(self):
+        self.delete_released_buffers()
+        self.delete_evicted_textures()
+        self.upload_time = 0.
+        self.pending_uploads = False
+        self.frame_stats = Renderer.new_frame_stats()
+
+    def init_state(self):
         glEnable(GL_DEPTH_TEST)
         glEnable(GL_CULL_FACE)
         glCullFace(GL_FRONT)
@@ -38,175 +123,298 @@ class Renderer:
         glColorMaterial(GL_FRONT, GL_DIFFUSE)
         glEnable(GL_COLOR_MATERIAL)
 
-        self.load_textures()
-        self.initialized = True
+    def init_shaders(self):
+        if self.instance_program is not None:
+            return
+        if not (bool(glDrawElementsInstanced) and bool(glVertexAttribDivisor)):
+            print("Instanced rendering not supported, props are drawn one by one")
+            return
+        try:
+            self.instance_program = shaders.compileProgram(
+                shaders.compileShader(INSTANCED_VERTEX_SHADER, GL_VERTEX_SHADER),
+                shaders.compileShader(INSTANCED_FRAGMENT_SHADER, GL_FRAGMENT_SHADER))
+        except RuntimeError as e:
+            print("can't compile the instancing shader, props are drawn one by one", e)
+            return
+        self.instance_location = glGetAttribLocation(self.instance_program, 'instance_matrix')
+        self.white_texture = Renderer.create_white_texture()
 
-    def load_textures(self):
-        for k in self.asset_manager.textures.keys():
-            dds_image = self.asset_manager.textures[k]
-            tex_id = glGenTextures(1)
-            glBindTexture(GL_TEXTURE_2D, tex_id)
+    @staticmethod
+    def create_white_texture():
+        texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, texture)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, 1, 1, 0, GL_RGBA, GL_UNSIGNED_BYTE, b'\xff' * 4)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        return texture
+
+    @staticmethod
+    def get_compressed_formats():
+        formats = {}
+        if extensions.hasGLExtension('GL_EXT_texture_compression_s3tc'):
+            formats['BC1'] = GL_COMPRESSED_RGBA_S3TC_DXT1_EXT
+            formats['BC2'] = GL_COMPRESSED_RGBA_S3TC_DXT3_EXT
+            formats['BC3'] = GL_COMPRESSED_RGBA_S3TC_DXT5_EXT
+        if extensions.hasGLExtension('GL_ARB_texture_compression_rgtc'):
+            formats['BC4'] = GL_COMPRESSED_RED_RGTC1
+            formats['BC5'] = GL_COMPRESSED_RG_RGTC2
+        if extensions.hasGLExtension('GL_ARB_texture_compression_bptc'):
+            formats['BC7'] = GL_COMPRESSED_RGBA_BPTC_UNORM
+        return formats
+
+    def can_upload(self):
+        """Whether there is time left in this frame to upload a mesh or a texture"""
+        if self.upload_time < self.upload_budget:
+            return True
+        self.pending_uploads = True
+        return False
+
+    def get_texture(self, name):
+        # Textures are uploaded the first time they are used, and again in place when the manager replaces
+        # their image by a higher resolution one
+        dds_image = self.asset_manager.textures.get(name, None)
+        if dds_image is None:
+            return None
+        if self.uploaded_textures.get(name, None) is not dds_image:
+            if not self.can_upload():
+                # The previous level stays bound until there is time to upload this one
+                return self.textures.get(name, None)
+            start = time.perf_counter()
+            if name not in self.textures.keys():
+                self.textures[name] = glGenTextures(1)
+            glBindTexture(GL_TEXTURE_2D, self.textures[name])
+            self.upload_texture(dds_image)
+            self.uploaded_textures[name] = dds_image
+            self.upload_time += time.perf_counter() - start
+        return self.textures[name]
+
+    def delete_evicted_textures(self):
+        """Delete the textures the manager cache evicted, checked when the cache changes"""
+        cache = self.asset_manager.textures
+        if cache.version == self.textures_version:
+            return
+        self.textures_version = cache.version
+        evicted = [name for name in self.textures.keys() if not cache.has(name)]
+        if evicted:
+            glDeleteTextures([self.textures.pop(name) for name in evicted])
+        for name in evicted:
+            self.uploaded_textures.pop(name, None)
+
+    def upload_texture(self, dds_image):
+        """Upload a texture to the bound texture object"""
+        if dds_image.is_compressed() and dds_image.format not in self.compressed_formats.keys():
+            dds_image = dds_image.decompress()
+        if dds_image.is_compressed():
+            internal_format = self.compressed_formats[dds_image.format]
+            for level, (width, height, data) in enumerate(dds_image.mipmaps):
+                glCompressedTexImage2D(GL_TEXTURE_2D, level, internal_format, width, height, 0, data)
+            # The mip chain stored in the file may be incomplete
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, len(dds_image.mipmaps) - 1)
+        else:
             glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, dds_image.width, dds_image.height, 0, GL_RGBA, GL_UNSIGNED_BYTE,
                          dds_image.data)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, 1000)
             glGenerateMipmap(GL_TEXTURE_2D)
-            self.textures[k] = tex_id
 
-    def render_asset(self, asset):
-        # Render the models:
-        for m in asset.models:
-            model_name = m.filename
+    def get_buffer(self, key, mesh):
+        # Meshes are uploaded the first time they are drawn, the manager cache may hold meshes of other files
+        buffer = self.buffers.get(key, None)
+        if buffer is None:
+            if not self.can_upload():
+                return None
+            start = time.perf_counter()
+            buffer = MeshBuffer(mesh)
+            buffer.upload()
+            self.buffers[key] = buffer
+            self.upload_time += time.perf_counter() - start
+        return buffer
+
+    def release_buffers(self):
+        # The GL context may not be current here, buffers are deleted on the next frame
+        self.released_buffers += self.buffers.values()
+        self.buffers = {}
+
+    def delete_released_buffers(self):
+        for buffer in self.released_buffers:
+            buffer.delete()
+        self.released_buffers = []
 
-            glPushMatrix()
-            for t in m.transformers:
-                transformers = Renderer.get_chained_transformers(asset, t)
-                Renderer.apply_transformers(transformers)
-            if model_name in self.asset_manager.meshes.keys():
-                self.render_model(self.asset_manager.meshes[model_name], materials=m.materials)
-            glPopMatrix()
-
-        # Render the files:
-        for f in asset.files:
-            a = self.asset_manager.sub_assets.get(f.filename, None)
-            if a:
-                glPushMatrix()
-                for t in f.transformers:
-                    transformers = Renderer.get_chained_transformers(asset, t)
-                    Renderer.apply_transformers(transformers)
-                self.render_asset(a)
-                glPopMatrix()
-        # Render the props:
-        for pc in asset.prop_containers:
-            glPushMatrix()
-            for t in pc.transformers:
-                transformers = Renderer.get_chained_transformers(asset, t)
-                Renderer.apply_transformers(transformers)
-            for p in pc.props:
-                self.render_prop(p)
-            glPopMatrix()
-        # Render the decal
-        glColor3f(1.0, 1.0, 1.0)
-        for decal in asset.decals:
-            if not decal.is_terrain():
+    def render_asset(self, asset):
+        # The draw list is only built again when the asset or the loaded files change
+        prop_groups = self.scene.prop_groups
+        if self.scene.update(asset):
+            self.release_scene(prop_groups)
+        instancing = self.use_instancing and self.instance_program is not None
+        self.scene.update_bounds()
+        if self.culling:
+            self.frame_stats.update(self.scene.cull(self.camera.get_frustum_planes()))
+        else:
+            self.scene.visible[:] = True
+        visible = self.scene.visible
+        if self.use_lods:
+            sizes = self.camera.projected_sizes(self.scene.centers, self.scene.radii)
+        draws = []
+        lights = []
+        for item in self.scene.items:
+            if not visible[item.index]:
                 continue
-            extent = decal.get_extents()
-
+            if item.light is not None:
+                lights.append(item)
+                continue
+            if instancing and item.group is not None:
+                continue
+            mesh = item.mesh if item.mesh is not None else self.asset_manager.meshes.get(item.key, None)
+            if mesh is None:
+                continue
+            key = item.key
+            if self.use_lods and item.mesh is None and not item.prop:
+                key, mesh = self.get_lod(item, mesh, sizes[item.index])
+            self.add_draws(draws, self.get_buffer(key, mesh), item.textures, item=item)
+        if instancing:
+            for group in self.scene.prop_groups:
+                group.set_visible(visible)
+                mesh = self.asset_manager.meshes.get(group.key, None)
+                if mesh is not None and len(group.instances):
+                    self.add_draws(draws, self.get_buffer(group.key, mesh), group.textures, group=group)
+        self.submit_draws(draws)
+        self.render_lights(lights)
+
+    def get_lod(self, item, mesh, size):
+        """Key and mesh of the level of detail of a model for its size on screen.
+        Levels not loaded yet are requested, the model is drawn with its own mesh until they arrive"""
+        lods = self.asset_manager.find_mesh_lods(item.key)
+        if len(lods) < 2:
+            return item.key, mesh
+        item.lod = select_lod(size, item.lod, len(lods))
+        key = lods[item.lod]
+        lod_mesh = self.asset_manager.meshes.get(key, None)
+        if lod_mesh is None:
+            self.asset_manager.request_mesh(key, mesh.vertex_format)
+            return item.key, mesh
+        return key, lod_mesh
+
+    def render_lights(self, lights):
+        for item in lights:
             glPushMatrix()
-            glTranslatef(-extent[0], 0, -extent[2])
-            for t in decal.transformers:
-                transformers = Renderer.get_chained_transformers(asset, t)
-                Renderer.apply_transformers(transformers)
-            decal_mesh = Mesh.gen_square(extent[0] * 2, extent[2] * 2)
-            decal_materials = list(decal.materials)
-            self.render_model(decal_mesh, materials=decal_materials)
+            glMultMatrixf(item.gl_matrix)
+            Renderer.draw_light_marker()
             glPopMatrix()
-        # Render the lights
-        for light in asset.lights:
-            self.render_light(light, asset)
-
-    @staticmethod
-    def get_chained_transformers(asset, t):
-        transformer_list = []
-        if t is None:
-            return []
-        if t.config_type == 'ORIENTATION_TRANSFORM':
-            transformer_list += [t]
-        elif t.config_type == 'OBJECTLINK_TRANSFORM':
-            id = t.model_id
-            if len(asset.models) > id:
-                t2 = asset.models[id].transformers
-                for t3 in t2:
-                    transformer_list += Renderer.get_chained_transformers(asset, t3)
-
-        return transformer_list
-
-    @staticmethod
-    def apply_transformers(transformer_list):
-        for t in transformer_list:
-            if not isinstance(t, TransformerOrientation):
-                continue
-            pos = t.position
-            rot = t.rotation
-            scale = t.scale
-            glTranslatef(*pos)
-            Renderer.apply_rotation(rot)
-            glScalef(*([scale] * 3))
-
-    @staticmethod
-    def apply_rotation(vec4):
-        # Maybe check if the vector is normalized
-        angle = (math.acos(vec4[3]) * 2)
-        anorm = math.sqrt(vec4[0] ** 2 + vec4[1] ** 2 + vec4[2] ** 2)
-        if anorm != 0:
-            glRotatef(math.degrees(angle), vec4[0] / anorm, vec4[1] / anorm, vec4[2] / anorm)
-        else:
-            glRotatef(math.degrees(angle), vec4[0], vec4[1], vec4[2])
-
-    def render_prop(self, prop):
-        if prop.filename not in self.asset_manager.props.keys():
-            return
-        prp = self.asset_manager.props.get(prop.filename)
-        filename = prp.mesh_filename
-        mesh = self.asset_manager.meshes.get(filename, None)
-        if not mesh:
-            return
-        pos = prop.position
-        rot = prop.rotation
-        scale = prop.scale
-        glPushMatrix()
-        glTranslatef(*pos)
-        Renderer.apply_rotation(rot)
-        glScalef(*scale)
-        self.render_model(mesh, materials=prp.materials)
-        glPopMatrix()
-
-    def render_light(self, light, asset):
-        if light is None:
-            return
-
-        glPushMatrix()
-        for t in light.transformers:
-            transformers = Renderer.get_chained_transformers(asset, t)
-            Renderer.apply_transformers(transformers)
-        glScalef(light.range, light.range, light.range)
-        Renderer.draw_light_marker()
-        glPopMatrix()
 
-    def render_model(self, mesh, materials=None):
-        if mesh is None:
-            return
-        color_group = False
-        colors = [(1., 1., 1.), (1., 0., 0.), (0., 1., 0.), (0., 0., 1.), (1., 0., 1.), (1., 1., 0.), (0.0, 1., 1.)]
+    def release_scene(self, prop_groups):
+        """Delete the instance buffers of the previous draw list"""
+        for group in prop_groups:
+            if group.buffer is not None:
+                group.buffer.delete()
+                group.buffer = None
+
+    def render_model(self, buffer, textures=()):
+        self.submit_draws(self.add_draws([], buffer, textures))
+
+    def add_draws(self, draws, buffer, textures=(), item=None, group=None):
+        """Add a draw per group of a mesh: (state, buffer, props group, index offset, index count, draw item).
+        The state is what needs GL calls to change between two draws: (instanced, texture, buffers)"""
+        if buffer is None:
+            return draws
+        default_texture = self.get_default_texture(group)
+        for mesh_group in buffer.groups:
+            texture_id = None
+            if len(textures) > mesh_group['n']:
+                texture_id = self.get_texture(textures[mesh_group['n']])
+            if texture_id is None:
+                texture_id = default_texture
+            state = (group is not None, texture_id, (id(buffer), id(group)))
+            # offset and size are a range of the index buffer (32 bits indices)
+            draws.append((state, buffer, group, int(mesh_group['offset']), int(mesh_group['size']), item))
+        return draws
+
+    def get_default_texture(self, group=None):
+        # The instancing shader would sample black without a texture
+        return self.white_texture if group is not None else 0
+
+    def submit_draws(self, draws):
+        """Draw a list of draws sorted by state, changing the shader, texture and buffers only when they differ"""
+        self.frame_stats['state_changes_unsorted'] += count_state_changes([draw[0] for draw in draws])
+        if self.sort_draws:
+            # Stable: draws with the same state stay in the scene order
+            draws = sorted(draws, key=lambda draw: draw[0])
+        self.frame_stats['state_changes'] += count_state_changes([draw[0] for draw in draws])
+        self.frame_stats['draws'] += len(draws)
+        self.frame_stats['triangles'] += sum(size // 3 * (len(group.instances) if group is not None else 1)
+                                             for _, _, group, _, size, _ in draws)
+
+        self.begin_draws()
+        current_state = (None, None, None)
+        bound_buffer = None
+        for state, buffer, group, offset, size, item in draws:
+            instanced, texture_id, buffers = state
+            if instanced != current_state[0]:
+                self.use_program(instanced)
+            if texture_id != current_state[1]:
+                glBindTexture(GL_TEXTURE_2D, texture_id)
+            if buffers != current_state[2]:
+                self.unbind_buffers(bound_buffer)
+                self.bind_buffers(buffer, group)
+                bound_buffer = (buffer, group)
+            current_state = state
+            self.draw(buffer, group, offset, size, item)
+        self.unbind_buffers(bound_buffer)
+        self.end_draws(current_state[0])
+
+    def begin_draws(self):
         glColor3f(1.0, 1.0, 1.0)
-        vertex_data = mesh.ordered_vertices
-        vertex_data = np.array(vertex_data, dtype=np.float32)
-        vbo_data = vbo.VBO(np.array(vertex_data, dtype=np.float32))
-        vbo_data.bind()
         # Tutorial fixed pipeline rendering
         # https://www.youtube.com/watch?v=sUJo9KXFzAM
-
         glEnableClientState(GL_VERTEX_ARRAY)
         glEnableClientState(GL_NORMAL_ARRAY)
         glEnableClientState(GL_TEXTURE_COORD_ARRAY)
 
-        for i, group in enumerate(mesh.groups):
-            # We choose the correct material:
-            glBindTexture(GL_TEXTURE_2D, 0)
-            if materials:
-                if len(materials) > group.get('n'):
-                    material = list(materials)[group.get('n')]
-                    texture_name = material.diffuse_texture
-                    if texture_name in self.textures.keys():
-                        glBindTexture(GL_TEXTURE_2D, self.textures[texture_name])
-
-            if color_group:
-                glColor3f(*colors[group['n']])
-            # TODO:check the size of a vertex
-            offset = int(group['offset'])
-            size = int(group['size'])
-            glVertexPointer(3, GL_FLOAT, 32, vbo_data + offset * 32)
-            glNormalPointer(GL_FLOAT, 32, vbo_data + 12 + offset * 32)
-            glTexCoordPointer(2, GL_FLOAT, 32, vbo_data + 24 + offset * 32)
-            glDrawArrays(GL_TRIANGLES, 0, int(size))
+    def end_draws(self, instanced):
+        if instanced:
+            glUseProgram(0)
+
+    def use_program(self, instanced):
+        glUseProgram(self.instance_program if instanced else 0)
+
+    def draw(self, buffer, group, offset, size, item):
+        if group is not None:
+            glDrawElementsInstanced(GL_TRIANGLES, size, GL_UNSIGNED_INT, buffer.ibo + offset * 4, len(group.instances))
+        elif item is not None:
+            glPushMatrix()
+            glMultMatrixf(item.gl_matrix)
+            glDrawElements(GL_TRIANGLES, size, GL_UNSIGNED_INT, buffer.ibo + offset * 4)
+            glPopMatrix()
+        else:
+            glDrawElements(GL_TRIANGLES, size, GL_UNSIGNED_INT, buffer.ibo + offset * 4)
+
+    def bind_buffers(self, buffer, group=None):
+        buffer.vbo.bind()
+        buffer.ibo.bind()
+        glVertexPointer(3, GL_FLOAT, 32, buffer.vbo)
+        glNormalPointer(GL_FLOAT, 32, buffer.vbo + 12)
+        glTexCoordPointer(2, GL_FLOAT, 32, buffer.vbo + 24)
+        if group is None:
+            return
+        if group.buffer is None:
+            group.buffer = vbo.VBO(group.instances)
+        # A mat4 attribute takes 4 locations, one per column
+        group.buffer.bind()
+        for column in range(4):
+            location = self.instance_location + column
+            glEnableVertexAttribArray(location)
+            glVertexAttribPointer(location, 4, GL_FLOAT, GL_FALSE, 64, group.buffer + 16 * column)
+            glVertexAttribDivisor(location, 1)
+        group.buffer.unbind()
+
+    def unbind_buffers(self, bound_buffer):
+        if bound_buffer is None:
+            return
+        buffer, group = bound_buffer
+        if group is not None:
+            for column in range(4):
+                glVertexAttribDivisor(self.instance_location + column, 0)
+                glDisableVertexAttribArray(self.instance_location + column)
+        buffer.ibo.unbind()
+        buffer.vbo.unbind()
 
     @staticmethod
     def draw_circle(n_vertices=32):
@@ -246,6 +454,7 @@ class Renderer:
             self.initialize()
             return
 
+        self.begin_frame()
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
         glClearColor(0.5, 0.7, 1, 1)
         glColor3f(1.0, 1.0, 1.0)
@@ -253,7 +462,7 @@ class Renderer:
 
         if isinstance(model, Mesh):
             glDisable(GL_TEXTURE_2D)
-            self.render_model(model)
+            self.render_model(self.get_buffer(self.asset_manager.file_path, model))
         elif isinstance(asset, Asset):
             glEnable(GL_TEXTURE_2D)
             self.render_asset(asset)
@@ -0,0 +1,456 @@
+import numpy as np
+from asset import TransformerOrientation
+from mesh import Mesh
+
+# Projected sizes in pixels under which the next level of detail is drawn
+LOD_SIZES = (400, 160, 64)
+# Fraction a size goes past a threshold before the level changes, so that models don't pop back and forth
+LOD_HYSTERESIS = 0.2
+
+
+def transform_matrices(positions, rotations, scales):
+    """4x4 matrices of n transforms at once, same as glTranslatef(position), glRotatef and glScalef(scale).
+    Rotations are quaternions (x, y, z, w), scales are floats or (x, y, z) tuples."""
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+    rotations = np.asarray(rotations, dtype=np.float64).reshape(-1, 4)
+    n = len(positions)
+    scales = np.broadcast_to(np.asarray(scales, dtype=np.float64).reshape(n, -1), (n, 3))
+    # Axis and angle as glRotatef gets them in apply_rotation
+    angles = 2 * np.arccos(np.clip(rotations[:, 3], -1., 1.))
+    norms = np.linalg.norm(rotations[:, 0:3], axis=1)
+    axes = np.divide(rotations[:, 0:3], norms[:, None], out=np.zeros((n, 3)), where=norms[:, None] != 0)
+    # A null axis doesn't rotate
+    angles[norms == 0] = 0
+    c = np.cos(angles)[:, None, None]
+    s = np.sin(angles)[:, None, None]
+    x, y, z = axes[:, 0], axes[:, 1], axes[:, 2]
+    zeros = np.zeros(n)
+    cross = np.stack([np.stack([zeros, -z, y], axis=1),
+                      np.stack([z, zeros, -x], axis=1),
+                      np.stack([-y, x, zeros], axis=1)], axis=1)
+    rotation = c * np.eye(3) + s * cross + (1 - c) * axes[:, :, None] * axes[:, None, :]
+
+    matrices = np.zeros((n, 4, 4))
+    matrices[:, 0:3, 0:3] = rotation * scales[:, None, :]
+    matrices[:, 0:3, 3] = positions
+    matrices[:, 3, 3] = 1
+    return matrices
+
+
+def translation_matrix(x, y, z):
+    matrix = np.eye(4)
+    matrix[0:3, 3] = (x, y, z)
+    return matrix
+
+
+def mesh_sphere(positions):
+    """Bounding sphere of the vertices of a mesh: center of their box, distance to the farthest vertex"""
+    positions = np.asarray(positions, dtype=np.float64)
+    center = (positions.min(axis=0) + positions.max(axis=0)) / 2
+    return center, float(np.sqrt(((positions - center) ** 2).sum(axis=1).max()))
+
+
+def transform_spheres(matrices, centers, radii):
+    """Spheres moved by n matrices, the radii scaled by the largest scale of each matrix"""
+    centers = (matrices[:, 0:3, 0:3] @ centers[:, :, None])[:, :, 0] + matrices[:, 0:3, 3]
+    scales = np.linalg.norm(matrices[:, 0:3, 0:3], axis=1).max(axis=1)
+    return centers, radii * scales
+
+
+def merge_spheres(centers, radii):
+    """A sphere enclosing n spheres, centered on their box"""
+    center = ((centers - radii[:, None]).min(axis=0) + (centers + radii[:, None]).max(axis=0)) / 2
+    return center, float((np.linalg.norm(centers - center, axis=1) + radii).max())
+
+
+def select_lod(size, current, n_levels, sizes=LOD_SIZES, hysteresis=LOD_HYSTERESIS):
+    """Level of detail for a projected size in pixels: 0 above sizes[0], 1 above sizes[1]... up to n_levels - 1.
+    The current level is kept until the size goes past the thresholds around it by the hysteresis fraction"""
+    sizes = sizes[0:n_levels - 1]
+    if current is None:
+        return sum(1 for s in sizes if size < s)
+    coarser = sum(1 for s in sizes if size < s * (1 - hysteresis))
+    finer = sum(1 for s in sizes if size < s * (1 + hysteresis))
+    return min(max(current, coarser), finer)
+
+
+def count_state_changes(states):
+    """GL state changes needed to draw a sequence of draws: one per value of a state differing from the draw before"""
+    changes = 0
+    previous = None
+    for state in states:
+        if previous is None:
+            changes += len(state)
+        else:
+            changes += sum(1 for value, previous_value in zip(state, previous) if value != previous_value)
+        previous = state
+    return changes
+
+
+class TransformResolver:
+    """Resolves the transformers of the nodes of an asset, OBJECTLINK transformers being replaced by the
+    transformers of the linked model. The matrix of each model is computed once.
+    Links to models that don't exist and cycles of links are reported and ignored."""
+
+    def __init__(self, asset, name=''):
+        self.asset = asset
+        # Name of the asset in the messages
+        self.name = name
+        # Matrix of each model, by model index
+        self.model_matrices = {}
+        # Models being resolved, to detect the cycles
+        self.resolving = set()
+        self.errors = []
+        self.orientation_matrices = self.get_orientation_matrices(asset)
+
+    @staticmethod
+    def get_orientation_matrices(asset):
+        """Matrices of all the orientation transformers of an asset, computed in one batch, by id of transformer"""
+        nodes = asset.models + asset.files + asset.prop_containers + asset.decals + asset.lights
+        transformers = [t for node in nodes if node is not None for t in node.transformers
+                        if isinstance(t, TransformerOrientation)]
+        if not transformers:
+            return {}
+        matrices = transform_matrices([t.position for t in transformers], [t.rotation for t in transformers],
+                                      [t.scale for t in transformers])
+        return {id(t): matrix for t, matrix in zip(transformers, matrices)}
+
+    def report(self, message):
+        if message not in self.errors:
+            self.errors.append(message)
+            print("{}: {}".format(self.name, message) if self.name else message)
+
+    def check_model(self, model_id):
+        if not 0 <= model_id < len(self.asset.models):
+            self.report("transformer linked to model {}, there are {} models".format(model_id,
+                                                                                      len(self.asset.models)))
+            return False
+        if model_id in self.resolving:
+            self.report("cycle of transformers linked to model {}".format(model_id))
+            return False
+        return True
+
+    def get_matrix(self, transformers):
+        """Matrix of a list of transformers, product of their orientation transformers"""
+        matrix = np.eye(4)
+        for t in transformers:
+            if t is None:
+                continue
+            if t.config_type == 'ORIENTATION_TRANSFORM':
+                matrix = matrix @ self.orientation_matrices[id(t)]
+            elif t.config_type == 'OBJECTLINK_TRANSFORM':
+                matrix = matrix @ self.get_model_matrix(t.model_id)
+        return matrix
+
+    def get_model_matrix(self, model_id):
+        matrix = self.model_matrices.get(model_id, None)
+        if matrix is None:
+            if not self.check_model(model_id):
+                return np.eye(4)
+            self.resolving.add(model_id)
+            matrix = self.get_matrix(self.asset.models[model_id].transformers)
+            self.resolving.discard(model_id)
+            self.model_matrices[model_id] = matrix
+        return matrix
+
+
+class DrawItem:
+    """A mesh or a light marker to draw, with its world matrix"""
+
+    def __init__(self, key, matrix, textures=(), mesh=None, light=None, prop=False):
+        # Key of the mesh in AssetManager.meshes, or of the generated mesh of a decal
+        self.key = key
+        self.matrix = matrix
+        # Diffuse texture name of each material, groups of the mesh use the one of their index
+        self.textures = textures
+        # Mesh generated for decals, the other meshes are taken from the manager when drawn
+        self.mesh = mesh
+        self.light = light
+        self.prop = prop
+        # Position in the draw list and transposed float32 matrix for glMultMatrixf, set once the list is built
+        self.index = None
+        self.gl_matrix = None
+        # PropGroup the prop is drawn with
+        self.group = None
+        # Level of detail drawn, index in the levels of the mesh
+        self.lod = None
+
+
+class PropGroup:
+    """Props using the same mesh and textures, drawn together with one instanced call"""
+
+    def __init__(self, key, textures, items):
+        self.key = key
+        self.textures = textures
+        self.items = items
+        # Transposed float32 matrices of the props, one after the other: the columns are the instance attributes
+        self.gl_matrices = np.array([item.gl_matrix for item in items])
+        # Position of the props in the draw list, and the matrices of the visible ones, drawn from the buffer
+        self.indices = np.array([item.index for item in items], dtype=np.int64)
+        self.mask = None
+        self.instances = self.gl_matrices
+        # Buffer of the matrices, created by the renderer when the group is first drawn
+        self.buffer = None
+        # Vertex array object of the core profile renderer
+        self.vao = None
+
+    def set_visible(self, visible):
+        """Keep the matrices of the visible props, the buffer is updated when they change"""
+        mask = visible[self.indices]
+        if self.mask is not None and np.array_equal(mask, self.mask):
+            return
+        self.mask = mask
+        self.instances = np.ascontiguousarray(self.gl_matrices[mask])
+        if self.buffer is not None and len(self.instances):
+            self.buffer.set_array(self.instances)
+
+
+class BoundsNode:
+    """Node of the bounding sphere hierarchy: an asset or a prop container, covering the items start to end of the
+    draw list. The items directly in the node are leaves, the sub-assets and prop containers are children."""
+
+    def __init__(self, start, matrix, header=None):
+        self.start = start
+        self.end = start
+        self.matrix = matrix
+        # Center and radius of the cfg header, in the node space
+        self.header = header
+        self.children = []
+        # Ranges of the draw list of the items directly in the node
+        self.item_ranges = []
+        # World bounding sphere, a negative radius when there is nothing to draw yet
+        self.center = np.zeros(3)
+        self.radius = np.inf
+
+    def add_items(self, start, end):
+        if end > start:
+            self.item_ranges.append((start, end))
+
+    @property
+    def size(self):
+        """Nodes in the subtree, items included"""
+        return 1 + sum(child.size for child in self.children) + sum(end - start for start, end in self.item_ranges)
+
+
+class Scene:
+    """The models, sub-assets, props, decals and lights of an asset flattened into a draw list with world matrices.
+    The list is built again only when the asset changes, or when sub-assets and props arrive in the manager caches."""
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.asset = None
+        self.version = None
+        self.items = []
+        # Props of the items grouped by mesh and textures
+        self.prop_groups = []
+        # Transform resolver of each asset drawn, by id of asset
+        self.resolvers = {}
+        # Root of the bounding sphere hierarchy, the world bounding sphere of each item and its visibility in the
+        # last culled view. Unknown bounds (meshes not loaded) have an infinite radius
+        self.root = None
+        self.centers = np.zeros((0, 3))
+        self.radii = np.zeros(0)
+        self.visible = np.zeros(0, dtype=bool)
+        self.bounds_version = None
+        # Bounding sphere of each mesh, with the mesh it was computed for
+        self.mesh_spheres = {}
+
+    def get_version(self):
+        return self.manager.sub_assets.version, self.manager.props.version
+
+    def update(self, asset):
+        """Build the draw list if it is out of date, returns True if it was built again"""
+        version = self.get_version()
+        if asset is self.asset and version == self.version:
+            return False
+        if asset is not self.asset:
+            self.resolvers = {}
+        self.asset = asset
+        self.version = version
+        self.build(asset)
+        return True
+
+    def build(self, asset):
+        self.items = []
+        self.prop_groups = []
+        self.root = None
+        self.bounds_version = None
+        if asset is not None:
+            self.root = self.add_asset(asset, np.eye(4), ('',))
+        self.visible = np.ones(len(self.items), dtype=bool)
+        if self.items:
+            matrices = np.array([item.matrix for item in self.items])
+            gl_matrices = np.ascontiguousarray(matrices.transpose(0, 2, 1), dtype=np.float32)
+            for index, (item, gl_matrix) in enumerate(zip(self.items, gl_matrices)):
+                item.index = index
+                item.gl_matrix = gl_matrix
+        groups = {}
+        for item in self.items:
+            if item.prop:
+                groups.setdefault((item.key, item.textures), []).append(item)
+        for (key, textures), items in groups.items():
+            group = PropGroup(key, textures, items)
+            for item in items:
+                item.group = group
+            self.prop_groups.append(group)
+
+    def get_resolver(self, asset, name):
+        # Kept while the same asset is drawn, each asset is resolved and reported once
+        resolver = self.resolvers.get(id(asset), None)
+        if resolver is None or resolver.asset is not asset:
+            resolver = TransformResolver(asset, name)
+            self.resolvers[id(asset)] = resolver
+        return resolver
+
+    def add_asset(self, asset, parent, filenames):
+        """Add the items of an asset to the draw list, returns its node of the bounds hierarchy"""
+        resolver = self.get_resolver(asset, filenames[-1])
+        node = BoundsNode(len(self.items), parent, (asset.center, asset.radius) if asset.radius > 0 else None)
+        for m in asset.models:
+            matrix = parent @ resolver.get_matrix(m.transformers)
+            textures = tuple(material.diffuse_texture for material in m.materials)
+            self.items.append(DrawItem(m.filename, matrix, textures))
+        node.add_items(node.start, len(self.items))
+
+        for f in asset.files:
+            sub_asset = self.manager.sub_assets.get(f.filename, None)
+            # A cfg including itself would never end
+            if sub_asset is None or f.filename in filenames:
+                continue
+            matrix = parent @ resolver.get_matrix(f.transformers)
+            node.children.append(self.add_asset(sub_asset, matrix, filenames + (f.filename,)))
+
+        for pc in asset.prop_containers:
+            props = []
+            for p in pc.props:
+                prp = self.manager.props.get(p.filename, None)
+                if prp is not None:
+                    props.append((p, prp))
+            if not props:
+                continue
+            container = parent @ resolver.get_matrix(pc.transformers)
+            prop_matrices = container @ transform_matrices([p.position for p, _ in props],
+                                                           [p.rotation for p, _ in props],
+                                                           [p.scale for p, _ in props])
+            container_node = BoundsNode(len(self.items), container)
+            for (p, prp), matrix in zip(props, prop_matrices):
+                textures = tuple(material.diffuse_texture for material in prp.materials)
+                self.items.append(DrawItem(prp.mesh_filename, matrix, textures, prop=True))
+            container_node.add_items(container_node.start, len(self.items))
+            container_node.end = len(self.items)
+            node.children.append(container_node)
+
+        start = len(self.items)
+
+        for decal in asset.decals:
+            if not decal.is_terrain():
+                continue
+            extent = decal.get_extents()
+            matrix = parent @ translation_matrix(-extent[0], 0, -extent[2]) @ \
+                resolver.get_matrix(decal.transformers)
+            textures = tuple(material.diffuse_texture for material in decal.materials)
+            mesh = Mesh.gen_square(extent[0] * 2, extent[2] * 2)
+            self.items.append(DrawItem(('decal', extent[0], extent[2]), matrix, textures, mesh=mesh))
+
+        for light in asset.lights:
+            if light is None:
+                continue
+            matrix = parent @ resolver.get_matrix(light.transformers) @ \
+                np.diag([light.range, light.range, light.range, 1.])
+            self.items.append(DrawItem(None, matrix, light=light))
+        node.add_items(start, len(self.items))
+        node.end = len(self.items)
+        return node
+
+    def get_item_sphere(self, item):
+        """Bounding sphere of an item in its own space, None if its mesh isn't loaded"""
+        if item.light is not None:
+            # The marker is a unit sphere scaled by the range
+            return np.zeros(3), 1.
+        mesh = item.mesh if item.mesh is not None else self.manager.meshes.get(item.key, None)
+        if mesh is None or len(mesh.vertices) == 0:
+            return None
+        cached = self.mesh_spheres.get(item.key, None)
+        if cached is None or cached[0] is not mesh:
+            cached = (mesh, mesh_sphere(mesh.positions))
+            self.mesh_spheres[item.key] = cached
+        return cached[1]
+
+    def update_bounds(self):
+        """Compute the world bounding spheres again when meshes were loaded since the last time"""
+        version = self.manager.meshes.version
+        if version == self.bounds_version:
+            return
+        self.bounds_version = version
+        n = len(self.items)
+        centers = np.zeros((n, 3))
+        radii = np.full(n, np.inf)
+        known = []
+        for item in self.items:
+            sphere = self.get_item_sphere(item)
+            if sphere is not None:
+                known.append(item.index)
+                centers[item.index], radii[item.index] = sphere
+        if known:
+            matrices = np.array([self.items[i].matrix for i in known])
+            centers[known], radii[known] = transform_spheres(matrices, centers[known], radii[known])
+        self.centers = centers
+        self.radii = radii
+        if self.root is not None:
+            self.update_node_bounds(self.root)
+
+    def update_node_bounds(self, node):
+        centers = [self.centers[start:end] for start, end in node.item_ranges]
+        radii = [self.radii[start:end] for start, end in node.item_ranges]
+        for child in node.children:
+            self.update_node_bounds(child)
+            centers.append(child.center[None, :])
+            radii.append(np.array([child.radius]))
+        centers = np.concatenate(centers) if centers else np.zeros((0, 3))
+        radii = np.concatenate(radii) if radii else np.zeros(0)
+        # Leaves not loaded yet are left out, they are drawn once loaded and the bounds updated
+        finite = np.isfinite(radii) & (radii >= 0)
+        centers = centers[finite]
+        radii = radii[finite]
+        if len(radii) == 0:
+            node.center, node.radius = np.zeros(3), -1.
+            return
+        node.center, node.radius = merge_spheres(centers, radii)
+        if node.header is not None:
+            # The sphere of the cfg header is often tighter, it is used if it encloses the content
+            header_centers, header_radii = transform_spheres(node.matrix[None], np.array([node.header[0]], dtype=float),
+                                                             np.array([node.header[1]], dtype=float))
+            header_center, header_radius = header_centers[0], header_radii[0]
+            inside = np.linalg.norm(centers - header_center, axis=1) + radii <= header_radius * 1.001
+            if header_radius < node.radius and inside.all():
+                node.center, node.radius = header_center, float(header_radius)
+
+    def cull(self, planes):
+        """Set the visibility of the items inside the frustum planes, skipping the nodes outside.
+        Returns the count of visible and culled nodes"""
+        self.update_bounds()
+        self.visible = np.zeros(len(self.items), dtype=bool)
+        stats = {'nodes_visible': 0, 'nodes_culled': 0}
+        if self.root is not None:
+            self.cull_node(self.root, planes, stats)
+        return stats
+
+    def cull_node(self, node, planes, stats):
+        distances = planes[:, 0:3] @ node.center + planes[:, 3]
+        if node.radius < 0 or (distances < -node.radius).any():
+            stats['nodes_culled'] += node.size
+            return
+        if (distances >= node.radius).all():
+            # Inside all the planes, nothing to test below
+            self.visible[node.start:node.end] = True
+            stats['nodes_visible'] += node.size
+            return
+        stats['nodes_visible'] += 1
+        for child in node.children:
+            self.cull_node(child, planes, stats)
+        for start, end in node.item_ranges:
+            distances = self.centers[start:end] @ planes[:, 0:3].T + planes[:, 3]
+            inside = (distances >= -self.radii[start:end, None]).all(axis=1)
+            self.visible[start:end] = inside
+            stats['nodes_visible'] += int(inside.sum())
+            stats['nodes_culled'] += int(len(inside) - inside.sum())
@@ -0,0 +1,105 @@
+# GLSL sources of the renderer shaders
+
+# Props drawn with glDrawElementsInstanced: the fixed-function vertex arrays, and the world matrix of each prop
+# in the instance_matrix attribute. Lighting approximates the fixed-function light 0.
+INSTANCED_VERTEX_SHADER = """
+#version 120
+attribute mat4 instance_matrix;
+
+void main() {
+    vec4 position = instance_matrix * gl_Vertex;
+    // Inverse transpose of the instance matrix, its columns are orthogonal (rotation and scale). The normal isn't
+    // normalized, like in the fixed-function pipeline without GL_NORMALIZE
+    mat3 m = mat3(instance_matrix);
+    vec3 normal = gl_NormalMatrix * (m * (gl_Normal / vec3(dot(m[0], m[0]), dot(m[1], m[1]), dot(m[2], m[2]))));
+    float diffuse = max(dot(normal, normalize(gl_LightSource[0].position.xyz)), 0.0);
+    vec4 color = (gl_LightModel.ambient + gl_LightSource[0].ambient) * gl_FrontMaterial.ambient +
+                 gl_LightSource[0].diffuse * gl_Color * diffuse;
+    gl_FrontColor = vec4(clamp(color.rgb, 0.0, 1.0), gl_Color.a);
+    gl_TexCoord[0] = gl_MultiTexCoord0;
+    gl_Position = gl_ModelViewProjectionMatrix * position;
+}
+"""
+
+INSTANCED_FRAGMENT_SHADER = """
+#version 120
+uniform sampler2D diffuse_texture;
+
+void main() {
+    gl_FragColor = gl_Color * texture2D(diffuse_texture, gl_TexCoord[0].st);
+}
+"""
+
+# Core profile renderer: no fixed-function state, the camera is in the uniform block 0 and the world matrix of the
+# draw in the uniform block 1, or in the instance_matrix attribute with INSTANCED defined.
+# Lighting is the one of the fixed-function renderer: light 0 along the eye z axis, the default ambient terms.
+CORE_VERSION = """#version 330 core
+"""
+
+CORE_VERTEX_SHADER = """
+layout(std140) uniform Camera {
+    mat4 projection;
+    mat4 view;
+};
+layout(std140) uniform Draw {
+    mat4 model;
+};
+layout(location = 0) in vec3 position;
+layout(location = 1) in vec3 normal;
+layout(location = 2) in vec2 uv;
+layout(location = 3) in mat4 instance_matrix;
+out vec3 color;
+out vec2 tex_coord;
+
+void main() {
+#ifdef INSTANCED
+    mat4 model_view = view * instance_matrix;
+#else
+    mat4 model_view = view * model;
+#endif
+    // Not normalized, like in the fixed-function pipeline without GL_NORMALIZE
+    vec3 eye_normal = transpose(inverse(mat3(model_view))) * normal;
+    float diffuse = max(dot(eye_normal, vec3(0.0, 0.0, 1.0)), 0.0);
+    // (global ambient 0.2 + light ambient 1.0) * material ambient 0.2
+    color = clamp(vec3(0.24) + vec3(diffuse), 0.0, 1.0);
+    tex_coord = uv;
+    gl_Position = projection * model_view * vec4(position, 1.0);
+}
+"""
+
+CORE_FRAGMENT_SHADER = """
+uniform sampler2D diffuse_texture;
+in vec3 color;
+in vec2 tex_coord;
+out vec4 frag_color;
+
+void main() {
+    frag_color = vec4(color, 1.0) * texture(diffuse_texture, tex_coord);
+}
+"""
+
+# Axes and light markers, unlit colored lines
+CORE_LINE_VERTEX_SHADER = """
+layout(std140) uniform Camera {
+    mat4 projection;
+    mat4 view;
+};
+uniform mat4 model;
+layout(location = 0) in vec3 position;
+layout(location = 1) in vec4 line_color;
+out vec4 color;
+
+void main() {
+    color = line_color;
+    gl_Position = projection * view * model * vec4(position, 1.0);
+}
+"""
+
+CORE_LINE_FRAGMENT_SHADER = """
+in vec4 color;
+out vec4 frag_color;
+
+void main() {
+    frag_color = color;
+}
+"""
@@ -0,0 +1,122 @@
+from cache import *
+import numpy as np
+
+
+def test_lru_cache_eviction():
+    cache = LRUCache(3)
+    cache['a'] = 'a'
+    cache['b'] = 'b'
+    cache['c'] = 'c'
+    assert cache.get('a') == 'a'
+    cache['d'] = 'd'
+    assert cache.keys() == ['c', 'a', 'd']
+    assert cache.stats()['evictions'] == 1
+
+
+def test_lru_cache_size_budget():
+    cache = LRUCache(1000)
+    cache['small'] = np.zeros(100, dtype=np.uint8)
+    cache['big'] = np.zeros(950, dtype=np.uint8)
+    assert cache.keys() == ['big']
+    assert cache.size == 950
+    # An entry bigger than the budget is kept until the next one
+    cache['huge'] = np.zeros(2000, dtype=np.uint8)
+    assert cache.keys() == ['huge']
+
+
+def test_lru_cache_stats():
+    cache = LRUCache(10)
+    assert 'a' not in cache
+    cache['a'] = 1
+    assert 'a' in cache
+    assert 'a' in cache
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (2, 1, 1)
+    # Not counted
+    assert cache.has('a') and not cache.has('b')
+    assert (cache.stats()['hits'], cache.stats()['misses']) == (2, 1)
+
+
+def test_mesh_disk_cache(tmp_path):
+    from mesh import Mesh
+    from mesh_cache import MeshDiskCache
+    rdm_path = tmp_path / 'model.rdm'
+    rdm_path.write_bytes(b'rdm data')
+    mesh = Mesh.merge_meshes([Mesh.gen_square(1, 2), Mesh.gen_square(3, 4)])
+    mesh.vertex_format = 'P4h_N4b_G4b_B4b_T2h'
+    mesh_cache = MeshDiskCache(str(tmp_path / 'cache'))
+    key = mesh_cache.get_key('data\\model.rdm', str(rdm_path))
+    assert mesh_cache.load(key) is None
+    mesh_cache.save(key, mesh)
+
+    cached = mesh_cache.load(key)
+    # Read in memory, no file stays open
+    assert not isinstance(cached.vertices, np.memmap)
+    assert np.array_equal(cached.vertices, mesh.vertices)
+    assert np.array_equal(cached.indices, mesh.indices)
+    assert cached.groups == mesh.groups
+    # An other vertex format of the same size needs to decode the file again
+    assert mesh_cache.load(key, 'P4h_N4b_G4b_B4b_T2h') is not None
+    assert mesh_cache.load(key, 'P4h_N4b_G4b_B4b_T2h_I4b') is not None
+    assert mesh_cache.load(key, 'P4h_N4b_T2h_I4b_I4b') is None
+    # The key changes with the file
+    rdm_path.write_bytes(b'new rdm data')
+    assert mesh_cache.get_key('data\\model.rdm', str(rdm_path)) != key
+
+
+def test_asset_disk_cache(tmp_path):
+    import shutil
+    import lxml.etree as etree
+    from asset import Asset
+    from asset_cache import AssetDiskCache
+    path = str(tmp_path / 'workshop_03.cfg')
+    shutil.copy('workshop_03.cfg', path)
+    asset = Asset.from_tree(etree.parse(path))
+    asset_cache = AssetDiskCache(str(tmp_path / 'cache' / 'assets.sqlite'))
+    assert asset_cache.load(path) is None
+    asset_cache.save(path, asset)
+    assert asset_cache.load(path) == asset
+    # Editing the file invalidates the entry
+    with open(path, 'ab') as f:
+        f.write(b'\n')
+    assert asset_cache.load(path) is None
+    asset_cache.close()
+
+
+def test_asset_cache_outside_data_folder(tmp_path, monkeypatch):
+    import os
+    from asset_manager import AssetManager
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'user_cache'))
+    monkeypatch.setenv('LOCALAPPDATA', str(tmp_path / 'user_cache'))
+    manager = AssetManager()
+    manager.set_data_path(str(tmp_path / 'data') + os.sep)
+    assert manager.get_asset_cache().path.startswith(str(tmp_path / 'user_cache'))
+
+
+def test_file_catalogue(tmp_path):
+    from catalogue import FileCatalogue
+    data = tmp_path / 'data'
+    fallback = tmp_path / 'fallback'
+    (data / 'Graphics' / 'Props').mkdir(parents=True)
+    (fallback / 'graphics').mkdir(parents=True)
+    (data / 'Graphics' / 'Props' / 'Chair_01.prp').write_bytes(b'prp')
+    for level in [0, 1, 2]:
+        (data / 'Graphics' / 'Props' / 'chair_diff_{}.dds'.format(level)).write_bytes(b'dds')
+    (fallback / 'graphics' / 'only_fallback.cfg').write_bytes(b'cfg')
+    (fallback / 'graphics' / 'Props').mkdir()
+    (fallback / 'graphics' / 'Props' / 'chair_01.prp').write_bytes(b'older prp')
+    path = str(tmp_path / 'catalogue.json')
+    catalogue = FileCatalogue.open([str(data), str(fallback)], path)
+    assert len(catalogue) == 5
+    # Case and separators don't matter, the data folder has priority over the fallback folder
+    assert catalogue.resolve('graphics\\props\\CHAIR_01.prp') == str(data / 'Graphics' / 'Props' / 'Chair_01.prp')
+    assert catalogue.resolve('graphics/only_fallback.cfg') == str(fallback / 'graphics' / 'only_fallback.cfg')
+    assert catalogue.resolve('graphics/missing.cfg') is None
+    assert catalogue.get_texture_levels('graphics/props/chair_diff') == [0, 1, 2]
+    assert catalogue.get_texture_levels('graphics/props/missing') == []
+    # The stored catalogue is used next time, until it is scanned again
+    (data / 'new.cfg').write_bytes(b'cfg')
+    catalogue = FileCatalogue.open([str(data), str(fallback)], path)
+    assert 'new.cfg' not in catalogue
+    catalogue.scan()
+    assert 'NEW.cfg' in catalogue
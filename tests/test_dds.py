@@ -0,0 +1,77 @@
+from dds import *
+from PIL import Image
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("pixel_format, format", [
+    ('DXT1', 'BC1'),
+    ('DXT5', 'BC3'),
+])
+def test_parse_compressed_dds(tmp_path, pixel_format, format):
+    path = str(tmp_path / 'texture_0.dds')
+    Image.new('RGBA', (64, 32), (200, 20, 30, 255)).save(path, pixel_format=pixel_format)
+    with open(path, 'rb') as f:
+        dds_image = parse_dds(f.read(), path)
+    assert dds_image.is_compressed()
+    assert dds_image.format == format
+    assert (dds_image.width, dds_image.height) == (64, 32)
+    width, height, data = dds_image.mipmaps[0]
+    assert (width, height) == (64, 32)
+    assert len(data) == level_size(64, 32, format)
+    assert dds_image.decompress().data[:4] == read_rgba(path).data[:4]
+
+
+def test_parse_uncompressed_dds(tmp_path):
+    path = str(tmp_path / 'texture_0.dds')
+    Image.new('RGBA', (16, 16)).save(path)
+    with open(path, 'rb') as f:
+        assert parse_dds(f.read(), path) is None
+    assert read_rgba(path).format == 'RGBA'
+
+
+@pytest.mark.parametrize("width, height, format, size", [
+    (64, 32, 'BC1', 1024),
+    (64, 32, 'BC7', 2048),
+    (2, 1, 'BC3', 16),
+])
+def test_level_size(width, height, format, size):
+    assert level_size(width, height, format) == size
+
+
+def test_read_dimensions(tmp_path):
+    path = str(tmp_path / 'texture_0.dds')
+    Image.new('RGBA', (64, 32)).save(path, pixel_format='DXT1')
+    assert read_dimensions(path) == (32, 64)
+    png_path = str(tmp_path / 'texture.png')
+    Image.new('RGBA', (4, 4)).save(png_path)
+    assert read_dimensions(png_path) is None
+
+
+def test_decode_image_in_shared_memory(tmp_path):
+    from concurrent.futures import Future
+    from asset_manager import decode_image, create_image_block, receive_image
+    path = str(tmp_path / 'texture_0.dds')
+    Image.new('RGBA', (16, 8), (200, 20, 30, 255)).save(path)
+    shm = create_image_block(*read_dimensions(path))
+    future = Future()
+    future.set_result(decode_image(path, shm.name, 8, 16))
+    image = receive_image(shm, future)
+    assert (image.height, image.width) == (8, 16)
+    assert image.data == read_rgba(path).data
+
+
+def test_load_dds_keeps_no_map(tmp_path):
+    import mmap
+    from asset_manager import AssetManager
+    path = str(tmp_path / 'texture_0.dds')
+    Image.new('RGBA', (64, 32)).save(path, pixel_format='DXT1')
+    manager = AssetManager()
+    manager.set_data_path(str(tmp_path) + '/')
+    dds_image = manager.load_dds('texture_0.dds')
+    assert dds_image.is_compressed()
+    data = dds_image.mipmaps[0][2]
+    # The mip levels are views of the read data, not of a mapped file
+    while isinstance(data, (np.ndarray, memoryview)):
+        data = data.obj if isinstance(data, memoryview) else data.base
+    assert not isinstance(data, mmap.mmap)
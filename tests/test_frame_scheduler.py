@@ -0,0 +1,47 @@
+from frame_scheduler import *
+
+
+class Clock:
+    def __init__(self):
+        self.time = 0.
+
+    def __call__(self):
+        return self.time
+
+
+def test_requests_merged():
+    clock = Clock()
+    calls = []
+    frames = []
+    scheduler = FrameScheduler(lambda: frames.append(clock.time), lambda delay, f: calls.append((delay, f)),
+                               max_fps=50, clock=clock)
+    # A storm of events is drawn in one frame
+    for _ in range(10):
+        scheduler.request_frame()
+    assert len(calls) == 1 and calls[0][0] == 0
+    calls.pop()[1]()
+    assert frames == [0.]
+    # The next frame waits for the frame rate limit
+    clock.time = 0.005
+    scheduler.request_frame()
+    assert len(calls) == 1 and abs(calls[0][0] - 0.015) < 1e-9
+    clock.time = 0.02
+    calls.pop()[1]()
+    # Nothing is drawn without a request
+    assert calls == []
+    stats = scheduler.get_stats()
+    assert (stats['frames'], stats['requests']) == (2, 11)
+    assert abs(stats['fps'] - 50) < 1e-6
+
+
+def test_frame_times():
+    clock = Clock()
+
+    def draw():
+        clock.time += 0.004
+    scheduler = FrameScheduler(draw, lambda delay, f: f(), max_fps=0, clock=clock)
+    scheduler.request_frame()
+    scheduler.draw_frame()
+    stats = scheduler.get_stats()
+    assert abs(stats['frame_time'] - 4) < 1e-6 and abs(stats['max_frame_time'] - 4) < 1e-6
+    assert not scheduler.pending
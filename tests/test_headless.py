@@ -0,0 +1,45 @@
+import os
+import shutil
+import subprocess
+import sys
+import pytest
+from PIL import Image
+
+ROOT = os.path.abspath('..')
+
+
+def skip_without_egl():
+    # In other processes: the GL platform is chosen before OpenGL is imported
+    probe = subprocess.run([sys.executable, '-c', 'import headless; headless.set_platform("egl"); '
+                                                  'headless.create_context(8, 8)'], cwd=ROOT, capture_output=True)
+    if probe.returncode != 0:
+        pytest.skip("no offscreen EGL context")
+
+
+def test_headless_render(tmp_path):
+    skip_without_egl()
+    shutil.copy('workshop_03.cfg', str(tmp_path / 'workshop_03.cfg'))
+    output = str(tmp_path / 'workshop_03.png')
+    # The parsed files aren't cached in the cache folder of the user
+    env = dict(os.environ, XDG_CACHE_HOME=str(tmp_path / 'cache'), LOCALAPPDATA=str(tmp_path / 'cache'))
+    subprocess.run([sys.executable, os.path.join(ROOT, 'headless.py'), 'workshop_03.cfg', output,
+                    '--data', str(tmp_path), '--size', '64', '48', '--platform', 'egl'], cwd=str(tmp_path), env=env,
+                   check=True)
+    image = Image.open(output)
+    assert image.size == (64, 48)
+    # The background color of the viewer, the meshes aren't in the test data
+    assert image.getpixel((0, 0)) == (128, 178, 255)
+
+
+@pytest.mark.parametrize("content", [None, b'<Config><Unclosed>'])
+def test_headless_load_error(tmp_path, content):
+    skip_without_egl()
+    if content is not None:
+        (tmp_path / 'broken.cfg').write_bytes(content)
+    output = str(tmp_path / 'broken.png')
+    env = dict(os.environ, XDG_CACHE_HOME=str(tmp_path / 'cache'), LOCALAPPDATA=str(tmp_path / 'cache'))
+    result = subprocess.run([sys.executable, os.path.join(ROOT, 'headless.py'), 'broken.cfg', output,
+                             '--data', str(tmp_path), '--size', '64', '48', '--platform', 'egl'], cwd=str(tmp_path),
+                            env=env, capture_output=True)
+    assert result.returncode != 0
+    assert not os.path.exists(output)
@@ -0,0 +1,191 @@
+from loading import *
+import os
+import numpy as np
+import pytest
+
+
+def test_load_progress():
+    reports = []
+    progress = LoadProgress(callback=lambda p: reports.append(str(p)), interval=0)
+    progress.add_files(3)
+    progress.file_done()
+    progress.file_done(np.zeros(2 ** 20, dtype=np.uint8))
+    assert (progress.files_done, progress.files_total, progress.bytes_decoded) == (2, 3, 2 ** 20)
+    assert reports[-1] == "Loading: 2/3 files, 1.0 MB"
+    progress.file_done()
+    progress.finish()
+    assert reports[-1].startswith("Loaded: 3/3 files")
+
+
+def test_load_progress_cancel():
+    progress = LoadProgress()
+    progress.check_cancelled()
+    progress.cancel()
+    with pytest.raises(LoadCancelled):
+        progress.check_cancelled()
+    assert str(progress).startswith("Cancelled")
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_cancelled_load(tmp_path, max_workers):
+    import shutil
+    from asset_manager import AssetManager
+    from catalogue import FileCatalogue
+    path = str(tmp_path / 'workshop_03.cfg')
+    shutil.copy('workshop_03.cfg', path)
+    manager = AssetManager()
+    manager.max_workers = max_workers
+    manager.use_disk_cache = False
+    manager.catalogue = FileCatalogue([str(tmp_path)])
+    manager.set_file_path(path)
+    manager.load_main_file()
+    assert manager.main_asset is not None
+    assert manager.progress.finished
+    assert manager.progress.files_done == manager.progress.files_total
+    # A cancelled load stops before loading the file
+    progress = LoadProgress()
+    progress.cancel()
+    manager.load_main_file(progress)
+    assert not progress.finished
+    assert manager.main_asset is None
+    manager.close()
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_cancel_during_load(tmp_path, max_workers):
+    import shutil
+    import time
+    from asset_manager import AssetManager
+    from catalogue import FileCatalogue
+    path = str(tmp_path / 'workshop_03.cfg')
+    shutil.copy('workshop_03.cfg', path)
+    manager = AssetManager()
+    manager.max_workers = max_workers
+    manager.use_disk_cache = False
+    manager.catalogue = FileCatalogue([str(tmp_path)])
+    manager.set_file_path(path)
+    progress = LoadProgress()
+    resolve_path = manager.resolve_path
+    resolved = []
+
+    def slow_resolve_path(filename):
+        time.sleep(0.01)
+        resolved.append(filename)
+        if len(resolved) == 5:
+            progress.cancel()
+        return resolve_path(filename)
+
+    manager.resolve_path = slow_resolve_path
+    manager.load_main_file(progress)
+    assert not progress.finished
+    # Only the tasks already reading a file when the load was cancelled finish
+    assert len(resolved) <= 5 + max_workers - 1
+    manager.close()
+
+
+class RecordingWindow:
+    def __init__(self, manager):
+        self.manager = manager
+        self.events = []
+
+    def on_main_loaded(self):
+        self.events.append(('main', self.manager.main_asset is not None, self.manager.progress.finished))
+
+    def on_file_load(self):
+        self.events.append(('loaded', self.manager.main_asset is not None, self.manager.progress.finished))
+
+    def on_data_deleted(self):
+        self.events.append(('deleted',))
+
+    def on_texture_update(self):
+        pass
+
+    def on_load_progress(self, progress):
+        pass
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_main_asset_published_first(tmp_path, max_workers):
+    import shutil
+    from asset_manager import AssetManager
+    from catalogue import FileCatalogue
+    path = str(tmp_path / 'workshop_03.cfg')
+    shutil.copy('workshop_03.cfg', path)
+    manager = AssetManager()
+    manager.window = RecordingWindow(manager)
+    manager.max_workers = max_workers
+    manager.use_disk_cache = False
+    manager.catalogue = FileCatalogue([str(tmp_path)])
+    manager.set_file_path(path)
+    manager.load_main_file()
+    assert manager.window.events == [('deleted',), ('main', True, False), ('loaded', True, True)]
+    manager.close()
+
+
+def test_mesh_lods(tmp_path):
+    from asset_manager import AssetManager
+    from catalogue import FileCatalogue
+    for level in [0, 1, 3]:
+        (tmp_path / 'house_lod{}.rdm'.format(level)).write_bytes(b'rdm')
+    manager = AssetManager()
+    manager.use_disk_cache = False
+    manager.catalogue = FileCatalogue([str(tmp_path)])
+    manager.catalogue.scan()
+    assert manager.find_mesh_lods('House_lod0.rdm') == ['House_lod0.rdm', 'House_lod1.rdm', 'House_lod3.rdm']
+    assert manager.find_mesh_lods('house.rdm') == []
+    # Requested levels are loaded once, in background
+    reads = []
+    manager.read_rdm = lambda filename, vertex_format=None: reads.append(filename) or np.zeros(4)
+    manager.request_mesh('House_lod1.rdm')
+    manager.request_mesh('House_lod1.rdm')
+    manager.close()
+    assert reads == ['House_lod1.rdm']
+    assert 'House_lod1.rdm' in manager.meshes
+
+
+def test_missing_data_folder(tmp_path, monkeypatch):
+    import shutil
+    from asset_manager import AssetManager
+    path = str(tmp_path / 'workshop_03.cfg')
+    shutil.copy('workshop_03.cfg', path)
+    monkeypatch.chdir(tmp_path)
+    manager = AssetManager()
+    manager.set_data_path(str(tmp_path / 'missing_data') + os.sep)
+    manager.set_file_path(path)
+    manager.load_main_file()
+    assert manager.main_asset is not None
+    # No cache folder is created anywhere
+    assert sorted(os.listdir(str(tmp_path))) == ['workshop_03.cfg']
+    manager.close()
+
+
+def test_unreadable_asset_cache(tmp_path):
+    import shutil
+    from asset_manager import AssetManager
+    path = str(tmp_path / 'workshop_03.cfg')
+    shutil.copy('workshop_03.cfg', path)
+    manager = AssetManager()
+    # The database path is a folder
+    manager.asset_cache_path = str(tmp_path / 'cache' / 'assets.sqlite')
+    os.makedirs(manager.asset_cache_path)
+    manager.set_data_path(str(tmp_path) + os.sep)
+    manager.set_file_path(path)
+    manager.load_main_file()
+    assert manager.main_asset is not None
+    manager.close()
+
+
+def test_missing_file_reported_once(tmp_path, capsys):
+    from asset_manager import AssetManager
+    from catalogue import FileCatalogue
+    manager = AssetManager()
+    manager.catalogue = FileCatalogue([str(tmp_path)])
+    assert manager.resolve_path('missing.prp') is None
+    assert manager.resolve_path('missing.prp') is None
+    assert capsys.readouterr().out.count('file not found') == 1
+    # Found once the folder is scanned again
+    (tmp_path / 'missing.prp').write_bytes(b'')
+    manager.rescan_in_background()
+    manager.rescan_thread.join()
+    assert manager.resolve_path('missing.prp') is not None
+    manager.close()
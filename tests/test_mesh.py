@@ -0,0 +1,119 @@
+from mesh import *
+import numpy as np
+import glob
+import pytest
+
+
+def test_convert_normals():
+    normals = convert_normals([(128, 255, 128), (0, 128, 128), (255, 255, 0)])
+    assert normals.dtype == np.float32
+    assert normals.shape == (3, 3)
+    assert np.allclose(np.linalg.norm(normals, axis=1), 1)
+    assert np.allclose(normals[1], (-1, 0, 0), atol=0.01)
+
+
+@pytest.mark.parametrize("size_x, size_y", [
+    (1, 1),
+    (2.5, 4),
+])
+def test_gen_square(size_x, size_y):
+    mesh = Mesh.gen_square(size_x, size_y)
+    assert mesh.vertices.shape == (4, 8)
+    assert mesh.indices.shape == (6,)
+    assert np.allclose(mesh.positions.max(axis=0), (size_x, 0, size_y))
+
+
+def test_merge_meshes():
+    square = Mesh.gen_square(1, 1)
+    merged = Mesh.merge_meshes([square, Mesh.gen_square(2, 2)])
+    assert len(merged.positions) == 8
+    assert list(merged.indices) == [2, 1, 0, 3, 2, 0, 6, 5, 4, 7, 6, 4]
+    assert merged.groups[1] == {'offset': 6, 'size': 6, 'n': 0}
+    assert np.array_equal(merged.vertices[merged.indices[:6]], square.vertices[square.indices])
+
+
+@pytest.mark.parametrize("vertex_format, size", [
+    ('P4h_N4b_G4b_B4b_T2h', 24),
+    ('P4h_N4b_G4b_B4b_T2h_C4b_C4b', 32),
+    ('P4h_N4b_T2h_I4b', 20),
+])
+def test_vertex_dtype(vertex_format, size):
+    dtype = vertex_dtype(vertex_format)
+    assert dtype.itemsize == size
+    assert guess_vertex_format(size) == vertex_format
+
+
+def test_ambiguous_vertex_format():
+    # A float mesh and a skinned mesh have the same vertex size
+    assert vertex_dtype('P3f_N3f_G3f_T2f_T1f_T1f_T1f').itemsize == 56
+    assert vertex_dtype('P4h_N4b_G4b_B4b_T2h_I4b_I4b_I4b_I4b_W4b_W4b_W4b_W4b').itemsize == 56
+    with pytest.raises(ValueError, match='ambiguous'):
+        guess_vertex_format(56)
+    with pytest.raises(ValueError, match='ambiguous'):
+        decode_vertices([bytes(56)])
+    skinned = 'P4h_N4b_G4b_B4b_T2h_I4b_I4b_I4b_I4b_W4b_W4b_W4b_W4b'
+    assert decode_vertices([bytes(56)], skinned).dtype == vertex_dtype(skinned)
+
+
+def pack_vertices(vertices):
+    # P4h_N4b_G4b_B4b_T2h
+    import struct
+    return [struct.pack('<4e4B4B4B2e', *pos, *norm, *([0] * 8), *tex) for pos, norm, tex in vertices]
+
+
+def test_decode_vertices():
+    vertices = [((1, 2, 3, 1), (128, 255, 128, 0), (0.5, 0.25)), ((-1, 0.5, 8, 1), (0, 128, 128, 0), (1, 0))]
+    decoded = decode_vertices(pack_vertices(vertices))
+    assert np.array_equal(decoded['pos'], [v[0] for v in vertices])
+    assert np.array_equal(decoded['norm'], [v[1] for v in vertices])
+    assert np.array_equal(decoded['tex'], [v[2] for v in vertices])
+    assert list(decode_indices([b'\x01\x00', b'\x02\x01'])) == [1, 258]
+
+
+def pack_float_vertices(vertices):
+    # P3f_N3f_G3f_T2f_T1f_T1f_T1f
+    import struct
+    return [struct.pack('<3f3f3f2f3f', *pos, *norm, 0, 0, 0, *tex, 0, 0, 0) for pos, norm, tex in vertices]
+
+
+def test_decode_synthetic_block():
+    # A block as the rdm converter returns it: one bytes object per element
+    vertices = [((1.5, -2, 3), (0, 1, 0), (0.5, 0.75)), ((0, 0.25, -8), (1, 0, 0), (1, 0)),
+                ((4, 5, 6), (0, 0, -1), (0, 1))]
+    block = pack_float_vertices(vertices)
+    decoded = decode_vertices(block, 'P3f_N3f_G3f_T2f_T1f_T1f_T1f')
+    assert np.array_equal(decoded['pos'], [v[0] for v in vertices])
+    assert np.array_equal(decoded['norm'], [v[1] for v in vertices])
+    assert np.array_equal(decoded['tex'], [v[2] for v in vertices])
+    # Each element decoded on its own gives the same values as the whole block
+    for data, vertex in zip(block, decoded):
+        assert decode_vertices([data], 'P3f_N3f_G3f_T2f_T1f_T1f_T1f')[0] == vertex
+    faces = [(3).to_bytes(4, 'little'), (70000).to_bytes(4, 'little')]
+    assert list(decode_indices(faces)) == [3, 70000]
+
+
+RDM_SAMPLES = glob.glob('*.rdm')
+
+
+@pytest.mark.parametrize("filename", RDM_SAMPLES or [
+    pytest.param(None, marks=pytest.mark.skip(reason="no rdm sample file in tests/"))])
+def test_decode_matches_rdm_converter(filename):
+    rdm_conv = pytest.importorskip('anno_rdm_converter.rdm')
+    with open(filename, 'rb') as f:
+        rdm_file = rdm_conv.RDMFile.parse(f.read())
+    for mesh in rdm_file.main_record.get('mesh', []):
+        vertices = decode_vertices(mesh['vertices'])
+        for decoded, data in zip(vertices, mesh['vertices']):
+            vertex = rdm_conv.Vertex.decode(data)
+            assert np.array_equal(decoded['pos'][0:3], vertex['pos'][0:3])
+            assert np.array_equal(decoded['norm'][0:3], vertex['norm'][0:3])
+            assert np.array_equal(decoded['tex'][0:2], vertex['tex'][0:2])
+        indices = decode_indices(mesh['faces'])
+        assert list(indices) == [rdm_conv.VertexIndex.decode(t).index for t in mesh['faces']]
+
+
+def test_merge_meshes_empty():
+    merged = Mesh.merge_meshes([])
+    assert merged.vertices.shape == (0, 8)
+    assert merged.indices.shape == (0,)
+    assert merged.groups == []
@@ -0,0 +1,135 @@
+from scene import *
+from asset import Asset, PRP
+from cache import LRUCache
+import lxml.etree as etree
+import numpy as np
+import math
+
+
+class Manager:
+    def __init__(self):
+        self.sub_assets = LRUCache(100)
+        self.props = LRUCache(100)
+        self.meshes = LRUCache(1e9)
+
+
+def test_transform_matrices():
+    half = math.radians(45)
+    matrices = transform_matrices([(1, 2, 3), (0, 0, 0)], [(0, math.sin(half), 0, math.cos(half)), (0, 0, 0, 1)],
+                                  [2., 3.])
+    # 90 degrees around y, then scale, then translation
+    assert np.allclose(matrices[0] @ (1, 0, 0, 1), (1, 2, 1, 1))
+    assert np.allclose(matrices[0] @ (0, 1, 0, 1), (1, 4, 3, 1))
+    assert np.allclose(matrices[1], np.diag([3, 3, 3, 1]))
+    # Null axis and per axis scales
+    matrix = transform_matrices([(0, 0, 0)], [(0, 0, 0, 0.5)], [(1, 2, 3)])[0]
+    assert np.allclose(matrix, np.diag([1, 2, 3, 1]))
+
+
+def test_scene_build():
+    asset = Asset.from_tree(etree.parse('workshop_03.cfg'))
+    manager = Manager()
+    scene = Scene(manager)
+    assert scene.update(asset)
+    assert not scene.update(asset)
+    n_decals = len([d for d in asset.decals if d.is_terrain()])
+    assert len(scene.items) == len(asset.models) + n_decals + len(asset.lights)
+    assert all(item.gl_matrix.dtype == np.float32 for item in scene.items)
+    # Props are added once their prp file is loaded
+    prp = PRP.from_tree(etree.parse('chair_01.prp', parser=etree.XMLParser(recover=True)))
+    for pc in asset.prop_containers:
+        for p in pc.props:
+            manager.props[p.filename] = prp
+    assert scene.update(asset) == bool(asset.get_props())
+    assert len(scene.items) == len(asset.models) + n_decals + len(asset.lights) + len(asset.get_props())
+    # All the props use the same mesh and textures, they are drawn in one group
+    assert len(scene.prop_groups) == 1
+    assert scene.prop_groups[0].gl_matrices.shape == (len(asset.get_props()), 4, 4)
+    assert all(item.group is scene.prop_groups[0] for item in scene.items if item.prop)
+
+
+def test_transform_resolver():
+    from asset import Model3D, TransformerOrientation, TransformerObjectLink
+    move = TransformerOrientation(conditions=0, position=(1, 0, 0), rotation=(0, 0, 0, 1), scale=1.)
+    models = (Model3D(transformers=(move,)),
+              Model3D(transformers=(TransformerObjectLink(conditions=0, model_id=0), move)),
+              # Links to itself through model 3, and to a model that doesn't exist
+              Model3D(transformers=(TransformerObjectLink(conditions=0, model_id=3),)),
+              Model3D(transformers=(TransformerObjectLink(conditions=0, model_id=2),
+                                    TransformerObjectLink(conditions=0, model_id=7), None)))
+    resolver = TransformResolver(Asset(models=models), 'test.cfg')
+    assert np.allclose(resolver.get_model_matrix(0), translation_matrix(1, 0, 0))
+    assert np.allclose(resolver.get_model_matrix(1), translation_matrix(2, 0, 0))
+    assert np.allclose(resolver.get_model_matrix(2), np.eye(4))
+    assert np.allclose(resolver.get_model_matrix(3), np.eye(4))
+    # Each problem is reported once
+    assert len([e for e in resolver.errors if 'model 7' in e]) == 1
+    assert any('cycle' in e for e in resolver.errors)
+
+
+def test_count_state_changes():
+    states = [(False, 1, 'a'), (False, 2, 'b'), (False, 1, 'a'), (True, 2, 'b')]
+    assert count_state_changes(states) == 3 + 2 + 2 + 3
+    assert count_state_changes(sorted(states)) == 3 + 0 + 2 + 1
+    assert count_state_changes([]) == 0
+
+
+def test_camera():
+    from camera import Camera, rotation_matrix
+    assert np.allclose(rotation_matrix(90, 0., 1., 0.) @ (1, 0, 0, 1), (0, 0, -1, 1))
+    camera = Camera()
+    camera.set_view(200, 100, 0, 0, 0, 0, 0)
+    # The origin is 10 units in front of the camera, in the middle of the view
+    clip = camera.projection @ camera.view @ (0, 0, 0, 1)
+    assert np.allclose(clip[0:2] / clip[3], (0, 0))
+    assert -1 < clip[2] / clip[3] < 1
+    # The x axis is mirrored, and the view twice as wide as high
+    clip_x = camera.projection @ camera.view @ (1, 0, 0, 1)
+    clip_y = camera.projection @ camera.view @ (0, 1, 0, 1)
+    assert clip_x[0] / clip_x[3] < 0
+    assert np.isclose(-clip_x[0] / clip_x[3] * 2, clip_y[1] / clip_y[3])
+    assert camera.gl_view().flags['C_CONTIGUOUS'] and np.allclose(camera.gl_view()[3, 0:3], (0, 0, -10))
+
+
+def test_scene_culling():
+    from asset import Model3D, FileCFG, TransformerOrientation
+    from camera import Camera
+    from mesh import Mesh
+
+    def move(x):
+        return (TransformerOrientation(conditions=0, position=(x, 0, 0), rotation=(0, 0, 0, 1), scale=1.),)
+    manager = Manager()
+    manager.meshes['cube.rdm'] = Mesh(np.array([(x, y, z, 0, 0, 1, 0, 0) for x in (-1, 1) for y in (-1, 1)
+                                                for z in (-1, 1)]), [0, 1, 2])
+    # Two models near the origin, a sub-asset far to the side
+    manager.sub_assets['far.cfg'] = Asset(models=(Model3D(filename='cube.rdm'), Model3D(filename='cube.rdm')))
+    asset = Asset(models=(Model3D(filename='cube.rdm', transformers=move(1)), Model3D(filename='cube.rdm')),
+                  files=(FileCFG(filename='far.cfg', transformers=move(100), adapt_terrain_height=0, name=''),))
+    scene = Scene(manager)
+    scene.update(asset)
+    assert [item.index for item in scene.items] == [0, 1, 2, 3]
+    camera = Camera()
+    camera.set_view(100, 100, 0, 0, 0, 0, 0)
+    stats = scene.cull(camera.get_frustum_planes())
+    assert list(scene.visible) == [True, True, False, False]
+    # The sub-asset is culled as a whole: its node and its 2 models
+    assert stats == {'nodes_visible': 3, 'nodes_culled': 3}
+    assert np.allclose(scene.root.children[0].center, (100, 0, 0))
+    assert np.isclose(scene.root.children[0].radius, math.sqrt(3))
+    # The bounds are computed again when the meshes change, there is nothing to draw without them
+    manager.meshes.clear()
+    scene.cull(camera.get_frustum_planes())
+    assert scene.root.radius < 0 and not scene.visible.any()
+
+
+def test_select_lod():
+    sizes = (400, 160, 64)
+    assert [select_lod(size, None, 4, sizes) for size in (1000, 300, 100, 10)] == [0, 1, 2, 3]
+    # Only the levels there are
+    assert select_lod(10, None, 2, sizes) == 1
+    # Changes once past the threshold by the hysteresis
+    assert select_lod(390, 0, 4, sizes, 0.2) == 0
+    assert select_lod(310, 0, 4, sizes, 0.2) == 1
+    assert select_lod(450, 1, 4, sizes, 0.2) == 1
+    assert select_lod(490, 1, 4, sizes, 0.2) == 0
+    assert select_lod(10, 0, 4, sizes, 0.2) == 3